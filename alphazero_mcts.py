@@ -4,61 +4,62 @@ import numpy as np
 from math import sqrt, log
 
 from constants import *
+from search_budget import SearchBudget, deadline_after, solver_budget
+from transposition import TranspositionTable
+from threat_solver import ThreatSolver
 
 """
 PureMCTS --
 main mcts class
 - root: Node - init with root state
 - uct_search: action - best action from mcts
+- search(simulations): runs simulations without choosing a move
+- choose_action() -> action - move to play after search, without printing
+- root_visits() -> dict - maps: root action -> visits
+- advance(action): moves the root along a played action, reusing its subtree
 """
 class AlphaZeroMCTS:
-    def __init__(self, root_state):
-        self.root = Node(root_state, 999999999)
-        # policy value function from pretrained model
-        from gomoku_state import GRID_LEN
-        from policy_value_net_numpy import PolicyValueNetNumpy
-        if GRID_LEN == 6:
-            model_file = 'best_policy_6_6_4.model'
-        else:
-            model_file = 'best_policy_8_8_5.model'
-        import pickle
-        policy_params = pickle.load(open(model_file, 'rb'))
-        nn = PolicyValueNetNumpy(GRID_LEN, GRID_LEN, policy_params)
+    metrics = None # metrics.SearchMetrics, set by its attach()
+
+    """
+    transposition_table: TranspositionTable - shares stats and nn evaluations between nodes of
+    the same position and last move (see tt_key), a new one is made if None and TRANSPOSITION_TABLE is set
+    c: float - exploration constant of the puct score
+    """
+    def __init__(self, root_state, model_file=None, batch_size=SEARCH_BATCH_SIZE, transposition_table=None,
+                 c=PUCT_C):
+        self.c = c
+        if transposition_table is None and TRANSPOSITION_TABLE:
+            transposition_table = TranspositionTable(TT_SIZE, TT_REPLACEMENT)
+        self.transposition_table = transposition_table
+        self.root = self.make_node(root_state, 999999999)
+        self.solver = ThreatSolver(root_state.grid_len, root_state.win_amt)
+        # policy value function from pretrained model (loaded once per process)
+        from model_registry import get_evaluator
+        nn = get_evaluator(root_state.grid_len, model_file)
+        self.evaluator = nn
         self.policy_value_fn = nn.policy_value_fn
+        self.policy_value_batch_fn = nn.policy_value_batch_fn
+        # leaves evaluated per forward pass (1 searches one leaf at a time)
+        self.batch_size = batch_size
 
         # print "AlphaZeroMCTS init. Current state value:", self.value_policy(root_state)
 
     """
-    main algo loop
+    main algo loop, stops at whichever of the node and time budgets runs out first
+    simulations: int - node budget (None for no limit)
+    time_budget: float - seconds to search for (None for no limit)
     returns action - action sampled according to policy vector
     """
-    def uct_search(self):
-
-        counter = 0
-        while counter < THINK_TIME:
-            counter += 1
-
-            # tree policy (choosing leaf node) is the same
-            node_to_eval = self.tree_policy(self.root)
+    def uct_search(self, simulations=THINK_TIME, time_budget=THINK_SECONDS):
+        # the threat search's time comes out of the move's time budget
+        deadline = deadline_after(time_budget)
+        action = self.forced_move(*solver_budget(simulations, time_budget))
+        if action is not None:
+            print "Forced move:", action
+            return action
 
-            # value policy returns score if game ended otherwise uses nn to evaluate
-            if node_to_eval.terminal:
-                # value should always be -1 since the the current player of a terminal node has just lost
-                value = 1 if node_to_eval.state.curr_player == node_to_eval.state.winning_player else -1
-            else:
-                # value = 0.1 if node_to_eval.state.curr_player == self.rollout(node_to_eval) else -0.1
-                value = self.value_policy(node_to_eval.state)
-
-            self.backup(node_to_eval, value)
-
-            if PRINT_SEARCH_LEADER:
-                if counter % 100 == 0:
-                    print "Child leader while running search---"
-                    actions, probs = self.action_probs(self.root)
-                    action_probs = dict(zip(actions, probs))
-                    children = self.root.action_children.values()
-                    best = max(children, key= lambda c: c.visits)
-                    print("best ac so far: {}, Visits: {} Qval: {} Prior: {}".format(best.state.prev_move, best.visits, -best.q_val(), -best.prior))
+        self.search(simulations, deadline)
 
         if PRINT_PRIORS:
             print "Priors---"
@@ -68,11 +69,17 @@ class AlphaZeroMCTS:
 
         if PRINT_CHILD_STATS:
             print "Child stats---"
-            children = self.root.action_children.values()
-            children = sorted(children, key= lambda c: c.visits, reverse=True)
-            for child in children:
-                print("Action: {}, Visits: {} Qval: {} Prior: {}".format(child.state.prev_move, child.visits, -child.q_val(), -child.prior))
+            edges = self.root.edges
+            for i in np.argsort(-edges.visits, kind='mergesort'):
+                print("Action: {}, Visits: {} Qval: {} Prior: {}".format(edges.actions[i], edges.visits[i], edges.q_val(i), edges.priors[i]))
+
+        return self.choose_action()
 
+    """
+    picks the move to play from the root's visit counts (no searching or printing)
+    returns action - action sampled according to policy vector
+    """
+    def choose_action(self):
         actions, probs = self.action_probs(self.root)
         if DIRICHLET_NOISE:
             dirichlet = np.random.dirichlet(0.3 * np.ones(len(probs)))
@@ -83,15 +90,183 @@ class AlphaZeroMCTS:
         action = actions[idx]
         return action
 
+    """
+    returns action - move the threat solver finds without searching (None if THREAT_SOLVER is off)
+    max_nodes, deadline: budget of the threat search, see search_budget.solver_budget
+    """
+    def forced_move(self, max_nodes=None, deadline=None):
+        if not THREAT_SOLVER:
+            return None
+        return self.solver.forced_move(self.root.state, max_nodes, deadline)
+
+    """
+    runs simulations from the root until the budget runs out
+    simulations: int - node budget (None for no limit)
+    deadline: float - time.time() to stop at (None for no limit)
+    early_stop: bool - also stop once the most visited root child can't be overtaken
+    returns int - number of simulations done
+    """
+    def search(self, simulations=THINK_TIME, deadline=None, early_stop=EARLY_STOP):
+        budget = SearchBudget(simulations, deadline, self.leader_is_safe if early_stop else None)
+        if self.metrics is not None:
+            self.metrics.begin(self)
+        counter = 0
+        while not budget.done(counter):
+            prev_counter = counter
+            if self.batch_size > 1:
+                counter += self.batch_simulate(int(min(self.batch_size, budget.left(counter))))
+            else:
+                counter += 1
+
+                # tree policy (choosing leaf node) is the same
+                node_to_eval = self.tree_policy(self.root)
+
+                # value policy returns score if game ended otherwise uses nn to evaluate
+                if node_to_eval.terminal:
+                    value = self.terminal_value(node_to_eval)
+                else:
+                    # value = 0.1 if node_to_eval.state.curr_player == self.rollout(node_to_eval) else -0.1
+                    value, value_action_probs = self.evaluate(node_to_eval)
+                    self.expand_all(node_to_eval, value_action_probs)
+
+                self.backup(node_to_eval, value)
+
+            if PRINT_SEARCH_LEADER:
+                if counter // 100 > prev_counter // 100:
+                    print "Child leader while running search---"
+                    edges = self.root.edges
+                    best = np.argmax(edges.visits)
+                    print("best ac so far: {}, Visits: {} Qval: {} Prior: {}".format(edges.actions[best], edges.visits[best], edges.q_val(best), edges.priors[best]))
+        if self.metrics is not None:
+            self.metrics.end(self, counter)
+        return counter
+
+    """
+    remaining: float - simulations (at most) left in the budget
+    returns bool - whether the most visited root child stays ahead even if every remaining
+    simulation goes to the runner up
+    """
+    def leader_is_safe(self, remaining):
+        edges = self.root.edges
+        if edges is None:
+            return False
+        if len(edges.visits) < 2:
+            return True
+        runner_up, leader = np.partition(edges.visits, -2)[-2:]
+        return leader - runner_up > remaining
+
+    """
+    returns dict - maps: root action -> visits through its edge
+    """
+    def root_visits(self):
+        edges = self.root.edges
+        if edges is None:
+            return {}
+        return dict((action, int(visits)) for action, visits in zip(edges.actions, edges.visits))
+
+    """
+    moves the root to the child reached by action, keeping that subtree and its stats
+    so the next search starts with its visits already banked
+    the rest of the tree is detached so it can be garbage collected
+    returns nothing
+    """
+    def advance(self, action):
+        child = self.root.child(action)
+        if child is None:
+            child = self.make_node(self.root.state.apply_action(action), 999999999)
+        child.parent = None
+        child.parent_index = None
+        self.root.children = {}
+        self.root = child
+
+    """
+    one batched step: selects up to batch_size leaves using virtual loss so the selections
+    spread over different paths, evaluates them in a single forward pass and backs them up
+    returns int - number of simulations done
+    """
+    def batch_simulate(self, batch_size):
+        leaves = []
+        pending = set()
+        simulations = 0
+        while simulations < batch_size:
+            node = self.select_leaf(self.root)
+            simulations += 1
+            if node.terminal:
+                # no evaluation needed, back up right away
+                self.backup(node, self.terminal_value(node))
+                continue
+            if node in pending:
+                # collision: the virtual losses weren't enough to find another leaf
+                simulations -= 1
+                break
+            if node.entry is not None and node.entry.evaluation is not None:
+                # transposition already evaluated by the network
+                value, value_action_probs = node.entry.evaluation
+                self.expand_all(node, value_action_probs)
+                self.backup(node, value)
+                continue
+            self.add_virtual_loss(node, 1)
+            pending.add(node)
+            leaves.append(node)
+
+        if leaves:
+            from board_encoder import EncodedBoard
+            results = self.evaluate_boards([EncodedBoard(node.state) for node in leaves])
+            for node, (act_probs, value) in zip(leaves, results):
+                self.add_virtual_loss(node, -1)
+                value = self.tactical_value(node.state, value)
+                value_action_probs = dict(act_probs)
+                if node.entry is not None:
+                    node.entry.evaluation = (value, value_action_probs)
+                self.expand_all(node, value_action_probs)
+                self.backup(node, value)
+        return simulations
+
+    """
+    nn evaluation of a batch of boards
+    returns list - (act_probs, value) per board
+    """
+    def evaluate_boards(self, boards):
+        return self.policy_value_batch_fn(boards)
+
+    """
+    same descent as tree_policy but leaves expansion to the caller
+    returns node - unexpanded or terminal node
+    """
+    def select_leaf(self, node):
+        while not node.terminal and node.fully_expanded():
+            action, node = self.ucb_action_child(node)
+        return node
+
+    """
+    count: int - 1 to add a virtual loss along the path from node to the root, -1 to remove it
+    each node on the path gets an extra visit that counts as a win for the player to move there,
+    i.e. a loss for the parent choosing it
+    returns nothing
+    """
+    def add_virtual_loss(self, node, count):
+        while node is not None:
+            node.visits += count
+            node.value += count * VIRTUAL_LOSS
+            if node.parent is not None:
+                node.parent.edges.update(node.parent_index, count, count * VIRTUAL_LOSS)
+            node = node.parent
+
+    """
+    returns float - value of a terminal node for its current player
+    """
+    def terminal_value(self, node):
+        # value should always be -1 since the the current player of a terminal node has just lost
+        return 1 if node.state.curr_player == node.state.winning_player else -1
+
     """
     explores using ucb and chooses node to simulate
-    returns node - node to simulate
+    returns node - node to simulate, the caller expands it with the priors of its evaluation
     """
     def tree_policy(self, node):
         while not node.terminal:
             # ucb val is technically inf
             if not node.fully_expanded():
-                self.expand_all(node)
                 return node
             else:
                 action, child = self.ucb_action_child(node)
@@ -100,38 +275,86 @@ class AlphaZeroMCTS:
 
     """
     fully expand node with priors from value_policy
-    modifies: node.untried_actions, node.action_children
+    only the edges are created, child nodes (and their states) are made when first selected
+    value_action_probs: action -> float - priors if already evaluated
+    modifies: node.edges
     returns nothing
     """
-    def expand_all(self, node):
-        node.untried_actions = set()
+    def expand_all(self, node, value_action_probs=None):
+        if node.entry is not None and node.entry.edges is not None:
+            # share the edges (and their stats) of an already expanded transposition
+            node.edges = node.entry.edges
+            return
+        if value_action_probs is None:
+            value, value_action_probs = self.evaluate(node)
+        actions = list(node.all_actions)
+        node.edges = Edges(actions, [value_action_probs[action] for action in actions])
+        if node.entry is not None:
+            node.entry.edges = node.edges
+
+    """
+    returns Node - node for state, sharing its stats through the transposition table if enabled
+    """
+    def make_node(self, state, prior):
+        if self.transposition_table is None:
+            return Node(state, prior)
+        return TTNode(state, prior, self.transposition_table.entry(tt_key(state)))
+
+    """
+    nn evaluation of a node, reused from the transposition table when a transposition has it
+    returns (float, action -> float) - (value, action probability vector)
+    """
+    def evaluate(self, node):
+        if node.entry is not None and node.entry.evaluation is not None:
+            return node.entry.evaluation
         value, value_action_probs = self.value_policy(node.state, action_probs=True)
-        for action in node.all_actions:
-            # make child node with next state + add edges
-            next_state = node.state.apply_action(action)
-            child_node = Node(next_state, -value_action_probs[action])
-            child_node.parent = node
-            node.action_children[action] = child_node
+        evaluation = (self.tactical_value(node.state, value), value_action_probs)
+        if node.entry is not None:
+            node.entry.evaluation = evaluation
+        return evaluation
+
+    """
+    returns float - value of state for its current player from the threat solver when it finds a
+    result (THREAT_AT_LEAVES), otherwise the nn value
+    """
+    def tactical_value(self, state, value):
+        if THREAT_AT_LEAVES:
+            known = self.solver.leaf_value(state)
+            if known is not None:
+                return known
+        return value
 
     """
     ucb
-    returns (action, node) - ucb optimal (action, child node) to explore
+    returns (action, node) - ucb optimal (action, child node) to explore, creating the child if
+    the edge was never selected before
     """
     def ucb_action_child(self, node):
-        best_action_child = max(node.action_children.items(), key= lambda (action, child): -child.ucb_val())
-        return best_action_child
+        edges = node.edges
+        # puct score of every edge at once: q + c*prior*sqrt(parent visits)/(1+visits)
+        ucb = edges.q_vals() + (self.c*sqrt(node.visits))*edges.priors/(1+edges.visits)
+        best_i = int(np.argmax(ucb))
+        return edges.actions[best_i], self.child_node(node, best_i)
+
+    """
+    returns Node - child through edge i of node, made from the next state if it doesn't exist yet
+    """
+    def child_node(self, node, i):
+        child = node.children.get(i)
+        if child is None:
+            edges = node.edges
+            child = self.make_node(node.state.apply_action(edges.actions[i]), -edges.priors[i])
+            child.parent = node
+            child.parent_index = i
+            node.children[i] = child
+        return child
 
     """
     returns ([action], [float]) - policy vector for given node
     """
     def action_probs(self, node, temp=0):
-        actions = list(node.state.possible_actions())
-        visits = map(lambda action: node.action_children[action].visits, actions)
-
-        if node.state.possible_actions() != set(node.action_children.keys()):
-            print "err: possible actions don't match action_children"
-            print node.state.possible_actions()
-            print node.action_children.keys()
+        actions = node.edges.actions
+        visits = node.edges.visits
 
         if temp == 0:
             best = np.argmax(visits)
@@ -164,9 +387,8 @@ class AlphaZeroMCTS:
     """
     def value_policy(self, state, action_probs=False):
         # return 0
-        from gomoku_state import NNBoardState
-        nn_board_state = NNBoardState(state)
-        act_probs, value = self.policy_value_fn(nn_board_state)
+        from board_encoder import EncodedBoard
+        act_probs, value = self.policy_value_fn(EncodedBoard(state))
         if action_probs:
             return value, dict(act_probs)
         return value
@@ -179,49 +401,107 @@ class AlphaZeroMCTS:
         while node is not None:
             node.visits += 1
             node.value += reward
+            if node.parent is not None:
+                node.parent.edges.update(node.parent_index, 1, reward)
             reward = -reward
             node = node.parent
 
 
+"""
+the network sees the last move as well as the stones (see NNBoardState.current_state), so only
+move orders ending in the same move share a transposition table entry and its evaluation
+returns (int, action) - transposition table key of state
+"""
+def tt_key(state):
+    return state.zobrist, state.prev_move
+
+
+"""
+Edges --
+stats of every action out of an expanded node, kept in parallel numpy arrays indexed by edge
+- actions: list - action of each edge
+- index: dict - maps: action -> edge index
+- priors: ndarray - nn prior of each action
+- visits: ndarray - visits through each edge
+- values: ndarray - value sum through each edge (from the perspective of the player moving at the child)
+- q_val(i) -> float - mean value of edge i for the player choosing it
+- q_vals() -> ndarray - q_val of every edge
+"""
+class Edges(object):
+    __slots__ = ('actions', 'index', 'priors', 'visits', 'values')
+
+    def __init__(self, actions, priors):
+        self.actions = actions
+        self.index = dict((action, i) for i, action in enumerate(actions))
+        self.priors = np.array(priors, dtype=np.float64)
+        self.visits = np.zeros(len(actions), dtype=np.int64)
+        self.values = np.zeros(len(actions), dtype=np.float64)
+
+    def update(self, i, visits, value):
+        self.visits[i] += visits
+        self.values[i] += value
+
+    def q_val(self, i):
+        return -float(self.values[i])/self.visits[i] if self.visits[i] > 0 else 0
+
+    def q_vals(self):
+        # unvisited edges have q 0 (their value sum is 0 too)
+        return -self.values/np.maximum(self.visits, 1)
+
+
 """
 Node --
 keeps track of state, actions, and stats info of the state
 - state: state
 - terminal: bool - directly corresponds to state.terminal
 - parent: Node
-- action_children: dict - maps: action -> child node
+- parent_index: int - index of the edge from parent to this node
+- edges: Edges - priors and stats of every action (None until expanded)
+- children: dict - maps: edge index -> child node, only for edges that have been selected
 - all_actions: set - const set of actions
-- untried_actions: set - set of untried actions
 - fully_expanded() -> bool
+- child(action) -> node
 - rand_action() -> action
-- rand_untried_action() -> action
 """
-class Node:
+class Node(object):
+    entry = None # TTEntry shared with transpositions (TTNode only)
+
     def __init__(self, state, prior):
         self.state = state
 
         self.terminal = state.terminal
         self.parent = None
-        self.action_children = {} # maps: actions -> nodes containing next state
+        self.parent_index = None
+        self.edges = None
+        self.children = {} # maps: edge index -> node containing next state
 
         possible_actions = state.possible_actions()
         # if len(possible_actions) == 0:
         #     print "POSSIBLE ACTIONS IS 0"
             # raise RuntimeError
         self.all_actions = set(possible_actions)
-        self.untried_actions = set(possible_actions)
 
-        # stats
-        self.visits = 0
-        self.value = 0
+        self.init_stats()
 
         self.prior = prior
 
+    def init_stats(self):
+        self.visits = 0
+        self.value = 0
+
     """
     returns bool - whether or not the node is fully expanded
     """
     def fully_expanded(self):
-        return len(self.untried_actions) == 0
+        return self.edges is not None
+
+    """
+    returns Node - existing child reached by action (None if it was never created)
+    """
+    def child(self, action):
+        if self.edges is None or action not in self.edges.index:
+            return None
+        return self.children.get(self.edges.index[action])
 
     """
     returns action - a random action from all_actions
@@ -231,21 +511,35 @@ class Node:
         rand_action = list(self.all_actions)[index]
         return rand_action
 
-    """
-    rm: bool - whether or not to remove the random action from untried_actions
-    returns action - a random action from untried_actions
-    """
-    def rand_untried_action(self, rm=False):
-        index = np.random.randint(len(self.untried_actions))
-        rand_untried_action = list(self.untried_actions)[index]
-        if rm:
-            self.untried_actions.remove(rand_untried_action)
-        return rand_untried_action
-
-    def ucb_val(self):
-        c = 5
-        # return float(self.losses)/self.visits + c*sqrt(2*log(self.parent.visits)/self.visits)
-        return self.q_val() + c*self.prior*sqrt(self.parent.visits)/(1+self.visits)
-
     def q_val(self):
         return float(self.value)/self.visits if self.visits > 0 else 0
+
+
+"""
+TTNode --
+Node whose visits and value live in a TTEntry shared by every node of the same position
+- entry: TTEntry
+"""
+class TTNode(Node):
+    def __init__(self, state, prior, entry):
+        self.entry = entry
+        Node.__init__(self, state, prior)
+
+    def init_stats(self):
+        pass # stats live in the (possibly already visited) entry
+
+    @property
+    def visits(self):
+        return self.entry.visits
+
+    @visits.setter
+    def visits(self, visits):
+        self.entry.visits = visits
+
+    @property
+    def value(self):
+        return self.entry.value
+
+    @value.setter
+    def value(self, value):
+        self.entry.value = value
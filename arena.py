@@ -0,0 +1,294 @@
+# Headless matches between search agents, e.g.
+#   python arena.py az:sims=400 pure:sims=2000 --games 20 --workers 4
+from __future__ import print_function
+import argparse
+import math
+import multiprocessing
+import multiprocessing.pool
+import time
+
+import numpy as np
+
+import pure_mcts
+from constants import GRID_LEN, THINK_TIME, BITBOARD_STATE, PATTERN_STATE
+from gomoku_state import GomokuState
+from bitboard_state import BitboardGomokuState
+from pattern_state import PatternGomokuState
+from alphazero_mcts import AlphaZeroMCTS
+from node_pool import PooledAlphaZeroMCTS
+from pure_mcts import PureMCTS
+from search_budget import deadline_after, solver_budget
+from metrics import SearchMetrics, JsonLinesSink
+import model_registry
+
+AGENT_KINDS = ('pure', 'az')
+
+"""
+agent spec: "<kind>[:key=value,...]"
+kind: 'pure' (PureMCTS) or 'az' (AlphaZeroMCTS)
+keys: sims - node budget per move, time - seconds per move, reuse - 0/1 keep the tree between moves,
+      c - puct constant (az), model - model file (az), batch - leaves per nn batch (az),
+      pool - 0/1 search on a NodePool (az)
+e.g. "az:sims=800,c=3", "pure:time=0.5"
+returns dict - parsed spec
+"""
+def parse_agent(spec):
+    kind, _, options = spec.partition(':')
+    if kind not in AGENT_KINDS:
+        raise ValueError("Unknown agent kind: {}".format(kind))
+    agent = {'name': spec, 'kind': kind, 'sims': None, 'time': None, 'reuse': True, 'pool': False,
+             'searcher_kwargs': {}}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        if key == 'sims':
+            agent['sims'] = int(value)
+        elif key == 'time':
+            agent['time'] = float(value)
+        elif key == 'reuse':
+            agent['reuse'] = value not in ('0', 'false', 'False')
+        elif key == 'c' and kind == 'az':
+            agent['searcher_kwargs']['c'] = float(value)
+        elif key == 'model' and kind == 'az':
+            agent['searcher_kwargs']['model_file'] = value
+        elif key == 'batch' and kind == 'az':
+            agent['searcher_kwargs']['batch_size'] = int(value)
+            if agent['searcher_kwargs']['batch_size'] < 1:
+                raise ValueError("batch must be at least 1")
+        elif key == 'pool' and kind == 'az':
+            agent['pool'] = value not in ('0', 'false', 'False')
+        else:
+            raise ValueError("Unknown option for {} agent: {}".format(kind, key))
+    check_budget(agent['sims'], agent['time'])
+    if agent['sims'] is None and agent['time'] is None:
+        agent['sims'] = pure_mcts.THINK_TIME if kind == 'pure' else THINK_TIME
+    return agent
+
+
+"""
+raises ValueError - unless sims (None for no node budget) is at least 1 and time (None for no time
+budget) is positive, a search with less never expands its root
+"""
+def check_budget(sims, time):
+    if sims is not None and sims < 1:
+        raise ValueError("sims must be at least 1")
+    if time is not None and time <= 0:
+        raise ValueError("time must be positive")
+
+
+"""
+returns object - new searcher of the kind in spec (from parse_agent) rooted at state
+"""
+def make_searcher(spec, state):
+    if spec['kind'] == 'az' and spec['pool']:
+        return PooledAlphaZeroMCTS(state, **spec['searcher_kwargs'])
+    elif spec['kind'] == 'az':
+        return AlphaZeroMCTS(state, **spec['searcher_kwargs'])
+    return PureMCTS(state, **spec['searcher_kwargs'])
+
+
+"""
+returns state - empty grid_len x grid_len board with black to move, of the state class picked in constants
+"""
+def empty_state(grid_len=GRID_LEN):
+    state_class = BitboardGomokuState if BITBOARD_STATE else GomokuState
+    if PATTERN_STATE:
+        state_class = PatternGomokuState
+    return state_class(['.'] * (grid_len * grid_len), 'b', None, None)
+
+
+"""
+Agent --
+plays moves for one side of a game with a searcher kept between moves
+- spec: dict - from parse_agent
+- moves, seconds, simulations: totals over the game
+- play(state) -> action - searches state and picks a move
+- observe(action) - follows a move played by either side
+"""
+class Agent:
+    def __init__(self, spec):
+        self.spec = spec
+        self.searcher = None
+        self.moves = 0
+        self.seconds = 0.0
+        self.simulations = 0
+
+    def play(self, state):
+        start = time.time()
+        if self.searcher is None:
+            self.searcher = make_searcher(self.spec, state)
+            if self.spec.get('metrics'):
+                SearchMetrics([JsonLinesSink(self.spec['metrics'])], tags={'agent': self.spec['name']}).attach(self.searcher)
+        deadline = deadline_after(self.spec['time'])
+        action = self.searcher.forced_move(*solver_budget(self.spec['sims'], self.spec['time']))
+        if action is None:
+            self.simulations += self.searcher.search(self.spec['sims'], deadline)
+            action = self.searcher.choose_action()
+        self.seconds += time.time() - start
+        self.moves += 1
+        return action
+
+    def observe(self, action):
+        if self.searcher is None:
+            return
+        if self.spec['reuse']:
+            self.searcher.advance(action)
+        else:
+            self.searcher = None
+
+    """
+    returns dict - move, time and simulation totals
+    """
+    def stats(self):
+        return {'moves': self.moves, 'seconds': self.seconds, 'simulations': self.simulations}
+
+
+"""
+plays one game to the end (in a pool process)
+job: (game index, black spec, white spec, seed, random opening plies, board size)
+returns dict - winner, number of plies and per side stats
+"""
+def play_game(job):
+    index, black_spec, white_spec, seed, opening, grid_len = job
+    np.random.seed(seed)
+    state = empty_state(grid_len)
+    agents = {'b': Agent(black_spec), 'w': Agent(white_spec)}
+    plies = 0
+    while not state.terminal:
+        if plies < opening:
+            # sorted so the opening only depends on the seed
+            actions = sorted(state.possible_actions())
+            action = actions[np.random.randint(len(actions))]
+        else:
+            action = agents[state.curr_player].play(state)
+        for agent in agents.values():
+            agent.observe(action)
+        state = state.apply_action(action)
+        plies += 1
+    return {'index': index, 'winner': state.winning_player, 'plies': plies,
+            'b': agents['b'].stats(), 'w': agents['w'].stats()}
+
+
+"""
+returns (float, float) - wilson score interval of a win rate, z = 1.96 for 95%
+"""
+def wilson_interval(wins, games, z=1.96):
+    if games == 0:
+        return 0.0, 1.0
+    p = float(wins) / games
+    denom = 1 + z*z/games
+    center = (p + z*z/(2*games)) / denom
+    margin = z * math.sqrt(p*(1-p)/games + z*z/(4*games*games)) / denom
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+"""
+returns float - elo difference implied by a score (clamped to +-800 at 0 and 1)
+"""
+def elo_diff(score):
+    score = min(max(score, 0.01), 0.99)
+    return -400 * math.log10(1/score - 1)
+
+
+"""
+plays games between agent a and agent b, alternating colours (a is black in even games)
+workers: int - games played at the same time in a process pool (1 plays them in this process)
+threads: bool - play them on a thread pool instead, so the searches share this process's
+evaluators (and batch their nn calls with EVAL_SERVICE); games then draw from one global
+random state and aren't reproducible
+grid_len: int - board size
+returns list - play_game results, ordered by game index
+"""
+def run_match(spec_a, spec_b, games, workers=1, seed=0, opening=0, verbose=True, threads=False, grid_len=GRID_LEN):
+    jobs = []
+    for i in range(games):
+        black, white = (spec_a, spec_b) if i % 2 == 0 else (spec_b, spec_a)
+        jobs.append((i, black, white, seed + i, opening, grid_len))
+
+    if workers > 1:
+        pool = multiprocessing.pool.ThreadPool(workers) if threads else multiprocessing.Pool(workers)
+        results_iter = pool.imap_unordered(play_game, jobs)
+    else:
+        pool = None
+        results_iter = (play_game(job) for job in jobs)
+    results = []
+    try:
+        for result in results_iter:
+            results.append(result)
+            if verbose:
+                a_colour = 'b' if result['index'] % 2 == 0 else 'w'
+                print("Game {}: {} won in {} plies".format(
+                    result['index'], "A" if result['winner'] == a_colour else "B", result['plies']))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return sorted(results, key=lambda result: result['index'])
+
+"""
+returns dict - a's wins (overall and by colour), score with confidence interval, elo estimate,
+and time per move / nodes per second of both agents
+"""
+def summarize(results):
+    summary = {'games': len(results), 'a_wins': 0, 'a_black_wins': 0, 'a_white_wins': 0}
+    totals = {'a': {'moves': 0, 'seconds': 0.0, 'simulations': 0}, 'b': {'moves': 0, 'seconds': 0.0, 'simulations': 0}}
+    for result in results:
+        a_colour = 'b' if result['index'] % 2 == 0 else 'w'
+        b_colour = 'w' if a_colour == 'b' else 'b'
+        if result['winner'] == a_colour:
+            summary['a_wins'] += 1
+            summary['a_black_wins' if a_colour == 'b' else 'a_white_wins'] += 1
+        for side, colour in (('a', a_colour), ('b', b_colour)):
+            for key in totals[side]:
+                totals[side][key] += result[colour][key]
+
+    games = summary['games']
+    summary['a_score'] = float(summary['a_wins']) / games if games else 0.0
+    summary['a_score_ci'] = wilson_interval(summary['a_wins'], games)
+    summary['elo'] = elo_diff(summary['a_score'])
+    summary['elo_ci'] = tuple(elo_diff(p) for p in summary['a_score_ci'])
+    for side in ('a', 'b'):
+        total = totals[side]
+        summary[side + '_seconds_per_move'] = total['seconds'] / total['moves'] if total['moves'] else 0.0
+        summary[side + '_nodes_per_second'] = total['simulations'] / total['seconds'] if total['seconds'] else 0.0
+    return summary
+
+def print_summary(spec_a, spec_b, summary):
+    games = summary['games']
+    black_games = (games + 1) // 2
+    print("A = {}, B = {}, {} games".format(spec_a['name'], spec_b['name'], games))
+    print("A wins: {} (as black {}/{}, as white {}/{}), B wins: {}".format(
+        summary['a_wins'], summary['a_black_wins'], black_games, summary['a_white_wins'], games - black_games,
+        games - summary['a_wins']))
+    print("A score: {:.3f}, 95% CI [{:.3f}, {:.3f}]".format(summary['a_score'], *summary['a_score_ci']))
+    print("Elo A - B: {:+.0f}, 95% CI [{:+.0f}, {:+.0f}]".format(summary['elo'], *summary['elo_ci']))
+    for side in ('a', 'b'):
+        print("{}: {:.3f} s/move, {:.0f} nodes/s".format(
+            side.upper(), summary[side + '_seconds_per_move'], summary[side + '_nodes_per_second']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play headless games between two search agents.")
+    parser.add_argument('agent_a', help="agent spec, e.g. az:sims=400,c=5 or pure:time=0.5")
+    parser.add_argument('agent_b', help="agent spec")
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help="games played at once")
+    parser.add_argument('--seed', type=int, default=0, help="game i is seeded with seed + i")
+    parser.add_argument('--opening', type=int, default=0, help="random plies played before the agents take over")
+    parser.add_argument('--metrics', help="append per search metrics of both agents to this json lines file")
+    parser.add_argument('--size', type=int, default=GRID_LEN, help="board size (az agents need a model for it)")
+    parser.add_argument('--threads', action='store_true',
+                        help="play the games on threads of this process (shared evaluators, not reproducible)")
+    args = parser.parse_args()
+
+    spec_a, spec_b = parse_agent(args.agent_a), parse_agent(args.agent_b)
+    spec_a['metrics'] = spec_b['metrics'] = args.metrics
+    results = run_match(spec_a, spec_b, args.games, min(args.workers, args.games), args.seed, args.opening,
+                        threads=args.threads, grid_len=args.size)
+    print_summary(spec_a, spec_b, summarize(results))
+    service = model_registry.get_eval_service(args.size) if args.threads else None
+    if service is not None:
+        stats = service.stats()
+        print("Evaluation service: {} boards in {} batches ({:.1f} per batch), queueing {:.2f} ms mean, "
+              "{:.2f} ms p95".format(stats['boards'], stats['batches'], stats['mean_batch'],
+                                     stats['latency_mean'] * 1e3, stats['latency_p95'] * 1e3))
+        print("Batch sizes: {}".format(", ".join("{}: {}".format(size, count)
+                                                 for size, count in sorted(stats['batch_sizes'].items()))))
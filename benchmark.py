@@ -0,0 +1,264 @@
+# Reproducible timings of the state, network and search hot paths, e.g.
+#   python benchmark.py --save baseline.json
+#   python benchmark.py --baseline baseline.json --threshold 0.1
+from __future__ import print_function
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+
+import numpy as np
+
+from gomoku_state import GomokuState, NNBoardState
+from bitboard_state import BitboardGomokuState
+from pattern_state import PatternGomokuState
+from candidates import Candidates
+from board_encoder import EncodedBoard, encode_batch
+from alphazero_mcts import AlphaZeroMCTS
+from pure_mcts import PureMCTS
+from policy_value_net_numpy import im2col_indices
+import model_registry
+
+# fixed positions per board size: name -> moves played from the empty board (none of them won)
+POSITIONS = {
+    6: [
+        ('opening', [(0, 5), (1, 4), (1, 5)]),
+        ('midgame', [(2, 4), (1, 5), (3, 5), (1, 4), (0, 4), (4, 5), (3, 4), (5, 4), (0, 5), (5, 3)]),
+        ('endgame', [(4, 0), (5, 1), (3, 1), (5, 0), (4, 2), (2, 2), (3, 2), (4, 1), (2, 0), (5, 3), (1, 1),
+                     (4, 3), (2, 1), (1, 3), (1, 0), (0, 2), (2, 4), (0, 3), (3, 5), (5, 4), (3, 3), (3, 4)]),
+    ],
+    8: [
+        ('opening', [(3, 6), (3, 5), (4, 7), (5, 6)]),
+        ('midgame', [(3, 6), (2, 7), (3, 5), (4, 5), (1, 6), (5, 5), (3, 4), (0, 5), (2, 5), (6, 6), (6, 4),
+                     (2, 3), (1, 7), (6, 3), (7, 6), (1, 2), (1, 4), (7, 5)]),
+        ('endgame', [(5, 2), (5, 1), (4, 3), (4, 0), (3, 2), (6, 2), (4, 1), (3, 1), (7, 2), (4, 2), (5, 0),
+                     (7, 3), (5, 4), (2, 3), (2, 2), (3, 4), (5, 5), (2, 0), (1, 0), (6, 5), (6, 0), (4, 6),
+                     (1, 4), (0, 5), (0, 3), (7, 0), (4, 5), (6, 6), (4, 7), (1, 1), (7, 6), (1, 6), (3, 5),
+                     (0, 2), (5, 3), (7, 1), (3, 3), (2, 7), (6, 1), (3, 7)]),
+    ],
+    15: [
+        ('opening', [(6, 8), (5, 8), (8, 6), (5, 6)]),
+        ('midgame', [(7, 10), (6, 5), (3, 7), (7, 8), (3, 5), (6, 11), (3, 10), (4, 3), (7, 3), (10, 8), (4, 6),
+                     (5, 5), (9, 3), (11, 8), (8, 7), (6, 9)]),
+        ('endgame', [(13, 9), (1, 8), (12, 2), (4, 11), (2, 12), (2, 8), (5, 3), (11, 8), (3, 7), (8, 9), (9, 5),
+                     (5, 13), (8, 2), (1, 11), (1, 12), (3, 12), (10, 1), (6, 10), (5, 5), (8, 11), (7, 2), (5, 1),
+                     (11, 6), (10, 5), (4, 4), (8, 8), (7, 13), (12, 8), (10, 9), (4, 10), (13, 11), (2, 7), (6, 8),
+                     (10, 13), (3, 1), (7, 7), (1, 6), (9, 12), (11, 3), (8, 7)]),
+    ],
+}
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+SEARCH_SIMULATIONS = {'az': 200, 'pure': 1000}
+SEARCH_SEED = 0
+CANDIDATE_RADII = [1, 2]
+
+"""
+returns state - position reached by playing moves from the empty board
+"""
+def replay(state_class, grid_len, moves):
+    state = state_class(['.'] * (grid_len * grid_len), 'b', None, None)
+    for move in moves:
+        state = state.apply_action(move)
+    return state
+
+"""
+returns list - (grid_len, name, moves) of every position, smallest boards first
+"""
+def positions():
+    return [(grid_len, name, moves) for grid_len in sorted(POSITIONS) for name, moves in POSITIONS[grid_len]]
+
+"""
+times fn with timeit, number calls per repeat
+returns dict - seconds: best time per call, median: median time per call, calls: total calls
+"""
+def measure(fn, number, repeat):
+    times = timeit.Timer(fn).repeat(repeat=repeat, number=number)
+    return {'seconds': min(times) / number, 'median': float(np.median(times)) / number, 'calls': number * repeat}
+
+"""
+returns int - calls per repeat so a repeat of fn takes about target seconds
+"""
+def calibrate(fn, target):
+    start = timeit.default_timer()
+    fn()
+    elapsed = max(timeit.default_timer() - start, 1e-7)
+    return max(1, int(target / elapsed))
+
+
+"""
+Benchmark --
+runs the benchmarks whose names contain one of filters and collects their results
+- results: dict - maps: benchmark name -> measure() result (plus extra fields for some benchmarks)
+- target: float - seconds each repeat should take
+- repeat: int - repeats per benchmark (best is reported)
+"""
+class Benchmark:
+    def __init__(self, filters=None, target=0.2, repeat=5, verbose=True):
+        self.filters = filters
+        self.target = target
+        self.repeat = repeat
+        self.verbose = verbose
+        self.results = {}
+
+    def wanted(self, name):
+        return not self.filters or any(f in name for f in self.filters)
+
+    def add(self, name, fn):
+        if not self.wanted(name):
+            return
+        result = measure(fn, calibrate(fn, self.target), self.repeat)
+        self.record(name, result)
+
+    def record(self, name, result):
+        self.results[name] = result
+        if self.verbose:
+            print("{:<48} {:>12.3f} us".format(name, result['seconds'] * 1e6))
+
+    """
+    GomokuState/BitboardGomokuState/PatternGomokuState methods, a Candidates update,
+    NNBoardState.current_state and the EncodedBoard encoding on every position of every board size
+    """
+    def bench_state(self):
+        for state_name, state_class in (('gomoku', GomokuState), ('bitboard', BitboardGomokuState),
+                                        ('pattern', PatternGomokuState)):
+            for grid_len, pos_name, moves in positions():
+                state = replay(state_class, grid_len, moves)
+                prefix = "state.{}/{}x{}/{}".format(state_name, grid_len, grid_len, pos_name)
+                grid = list(state.grid)
+                action = sorted(state.possible_actions())[0]
+                self.add(prefix + "/init", lambda: state_class(grid, state.curr_player, state.prev_move,
+                                                               state.prev_prev_move))
+                self.add(prefix + "/apply_action", lambda: state.apply_action(action))
+                self.add(prefix + "/get_options", state.get_options)
+                self.add(prefix + "/check_win", lambda: state.check_win(state.prev_move))
+
+        for radius in CANDIDATE_RADII:
+            for grid_len, pos_name, moves in positions():
+                grid = replay(GomokuState, grid_len, moves).grid
+                candidates = Candidates.from_grid(grid, grid_len, radius)
+                ind = grid.index('.')
+                self.add("candidates.r{}/{}x{}/{}/place".format(radius, grid_len, grid_len, pos_name),
+                         lambda: candidates.copy().place(ind))
+
+        for grid_len, pos_name, moves in positions():
+            nn_board = NNBoardState(replay(GomokuState, grid_len, moves))
+            self.add("nn_board/{}x{}/{}/current_state".format(grid_len, grid_len, pos_name), nn_board.current_state)
+            state = replay(GomokuState, grid_len, moves)
+            prefix = "encoder/{}x{}/{}".format(grid_len, grid_len, pos_name)
+            self.add(prefix + "/encode", lambda: encode_batch([EncodedBoard(state)]))
+            board = EncodedBoard(state)
+            probs = np.random.RandomState(SEARCH_SEED).rand(grid_len * grid_len)
+            self.add(prefix + "/act_probs", lambda: board.act_probs(probs))
+
+    """
+    policy_value_fn and batched policy_value of the pretrained nets, im2col_indices on the
+    first and hidden conv layer shapes
+    """
+    def bench_net(self):
+        for grid_len in sorted(model_registry.MODEL_FILES):
+            net = model_registry.get_policy_value_net(grid_len)
+            size = "{}x{}".format(grid_len, grid_len)
+            board = EncodedBoard(replay(GomokuState, grid_len, POSITIONS[grid_len][1][1]))
+            self.add("net/{}/policy_value_fn".format(size), lambda: net.policy_value_fn(board))
+            planes = np.random.RandomState(SEARCH_SEED).randint(0, 2, (max(BATCH_SIZES), 4, grid_len, grid_len))
+            planes = planes.astype(np.float32)
+            for batch_size in BATCH_SIZES:
+                batch = planes[:batch_size]
+                name = "net/{}/policy_value/batch{}".format(size, batch_size)
+                self.add(name, lambda: net.policy_value(batch))
+                if name in self.results:
+                    self.results[name]['per_position'] = self.results[name]['seconds'] / batch_size
+            for n, channels in ((1, 4), (32, 128)):
+                x = np.random.RandomState(SEARCH_SEED).rand(n, channels, grid_len, grid_len).astype(np.float32)
+                self.add("im2col/{}/n{}_c{}".format(size, n, channels), lambda: im2col_indices(x, 3, 3))
+
+    """
+    fixed budget searches from every position, seeded and with the evaluation cache cleared
+    so every repeat does the same work (az only on board sizes with a pretrained net)
+    """
+    def bench_search(self):
+        for kind, simulations in sorted(SEARCH_SIMULATIONS.items()):
+            for grid_len, pos_name, moves in positions():
+                name = "search.{}/{}x{}/{}".format(kind, grid_len, grid_len, pos_name)
+                if not self.wanted(name) or (kind == 'az' and grid_len not in model_registry.MODEL_FILES):
+                    continue
+                state = replay(GomokuState, grid_len, moves)
+                times = []
+                for _ in range(self.repeat):
+                    evaluator = model_registry.get_evaluator(grid_len) if kind == 'az' else None
+                    if hasattr(evaluator, 'clear'):
+                        evaluator.clear()
+                    np.random.seed(SEARCH_SEED)
+                    start = timeit.default_timer()
+                    searcher = AlphaZeroMCTS(state) if kind == 'az' else PureMCTS(state)
+                    searcher.search(simulations, early_stop=False)
+                    searcher.choose_action()
+                    times.append(timeit.default_timer() - start)
+                self.record(name, {'seconds': min(times), 'median': float(np.median(times)),
+                                   'calls': self.repeat, 'simulations_per_second': simulations / min(times)})
+
+    def run(self):
+        self.bench_state()
+        self.bench_net()
+        self.bench_search()
+        return self.results
+
+
+"""
+returns dict - machine readable report of results with the environment they were measured in
+"""
+def report(results):
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'grid_lens': sorted(POSITIONS),
+        },
+        'results': results,
+    }
+
+"""
+compares results to a baseline report
+threshold: float - allowed slowdown, e.g. 0.1 flags benchmarks more than 10% slower
+returns list - (name, baseline seconds, seconds, ratio) of the regressions
+"""
+def compare(results, baseline, threshold, verbose=True):
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['seconds']
+        new = results[name]['seconds']
+        ratio = new / old if old else float('inf')
+        if ratio > 1 + threshold:
+            regressions.append((name, old, new, ratio))
+        if verbose:
+            flag = "REGRESSION" if ratio > 1 + threshold else ("faster" if ratio < 1 - threshold else "")
+            print("{:<48} {:>8.2f}x {}".format(name, ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the state, network and search hot paths.")
+    parser.add_argument('filters', nargs='*', help="only run benchmarks whose names contain one of these")
+    parser.add_argument('--save', help="write the JSON report to this file")
+    parser.add_argument('--baseline', help="JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="allowed slowdown before a regression")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--target', type=float, default=0.2, help="seconds per repeat of the micro benchmarks")
+    args = parser.parse_args()
+
+    results = Benchmark(args.filters, args.target, args.repeat).run()
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report(results), f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("{} regression(s) over {:.0%}".format(len(regressions), args.threshold))
+            sys.exit(1)
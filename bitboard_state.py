@@ -0,0 +1,307 @@
+from state import State
+
+from constants import *
+from zobrist import get_zobrist_keys
+from gomoku_state import grid_len_of
+from candidates import get_neighbours
+
+"""
+BitboardGomokuState --
+GomokuState backed by integer bitboards instead of a list of 'b'/'w'/'.' strings
+- black, white: int - one bit per cell, cell (r, c) lives at bit r*(grid_len+1) + c
+- empty: int - mask of empty cells, legal moves are derived from it
+- near: int - with CANDIDATE_RADIUS, mask of the cells within the radius of a stone (options are
+  near & empty), else None
+Every row is padded with one guard bit that is never set, so shifting a board by a
+direction offset can't wrap a line around the edge of the board. Win detection ANDs the
+mover's board with itself shifted win_amt-1 times along each of the four line directions.
+Same constructor and attributes as GomokuState so it can be swapped in for the searchers.
+"""
+class BitboardGomokuState(State):
+
+    """
+    bits: (int, int) - (black, white) bitboards, used instead of grid when given
+    zobrist: int - hash of the position, must be given along with bits
+    grid_len: int - board size, must be given along with bits (else taken from grid)
+    win_amt: int - stones in a row to win, win_amt_for(grid_len) if not given
+    near: int - near mask if already known (apply_action ORs in the new stone's neighbourhood)
+    """
+    def __init__(self, grid, curr_player, prev_move, prev_prev_move, board=None, bits=None, zobrist=None,
+                 grid_len=None, win_amt=None, near=None):
+        tables = get_tables(grid_len if bits is not None else grid_len_of(grid))
+        if bits is None:
+            keys = get_zobrist_keys(tables.grid_len)
+            black = 0
+            white = 0
+            zobrist = 0
+            for ind, piece in enumerate(grid):
+                if piece == 'b':
+                    black |= tables.ind_bits[ind]
+                    zobrist ^= keys['b'][ind]
+                elif piece == 'w':
+                    white |= tables.ind_bits[ind]
+                    zobrist ^= keys['w'][ind]
+        else:
+            black, white = bits
+        self.zobrist = zobrist
+        self.tables = tables
+        self.grid_len = tables.grid_len
+        self.win_amt = win_amt if win_amt is not None else win_amt_for(tables.grid_len)
+        self.black = black
+        self.white = white
+        self.empty = tables.full & ~(black | white)
+        if near is None and CANDIDATE_RADIUS:
+            near_masks = tables.near_masks(CANDIDATE_RADIUS)
+            near = 0
+            for ind, bit in enumerate(tables.ind_bits):
+                if not self.empty & bit:
+                    near |= near_masks[ind]
+        self.near = near
+        self.options = self.get_options() # must be called before check_win
+
+        if DEBUG_BOARD:
+            self.board = board #for visual debugging
+        else:
+            self.board = None
+
+        self.prev_move = prev_move
+        self.prev_prev_move = prev_prev_move
+
+        # check win for opponent
+        terminal, winning_player = self.check_win(prev_move)
+
+        if LIMIT_TO_WINNING_MOVE:
+            # check guaranteed winning move for current player
+            almost_win, win_option = self.get_win_info(prev_prev_move)
+            if almost_win:
+                self.options = [win_option]
+
+        State.__init__(self, curr_player, terminal, winning_player)
+
+    def possible_actions(self):
+        return set(self.options)
+
+    """
+    returns BitboardGomokuState - new instance of next state after applying action
+    """
+    def apply_action(self, action):
+        bit = self.tables.move_bits[action]
+        if self.empty & bit:
+            black, white = self.black, self.white
+            if self.curr_player == 'b':
+                black |= bit
+                next_player = 'w'
+            else:
+                white |= bit
+                next_player = 'b'
+            ind = action[0] * self.grid_len + action[1]
+            next_zobrist = self.zobrist ^ get_zobrist_keys(self.grid_len)[self.curr_player][ind]
+            next_state = BitboardGomokuState(None, next_player, action, self.prev_move, self.board,
+                                             bits=(black, white), zobrist=next_zobrist,
+                                             grid_len=self.grid_len, win_amt=self.win_amt,
+                                             near=self.next_near(ind))
+            if self.board:
+                self.board.set_piece(action[0],action[1])
+            return next_state
+        else:
+            print("Bad action")
+            return None
+
+    """
+    flat list of 'b'/'w'/'.' in the same layout as GomokuState.grid (built on demand)
+    """
+    @property
+    def grid(self):
+        grid = []
+        for bit in self.tables.ind_bits:
+            if self.black & bit:
+                grid.append('b')
+            elif self.white & bit:
+                grid.append('w')
+            else:
+                grid.append('.')
+        return grid
+
+    """
+    returns list - list of reasonable actions
+    """
+    def get_options(self):
+        tables = self.tables
+        empty = self.empty
+        if self.near is not None:
+            if empty == tables.full:
+                return [((self.grid_len-1)//2, (self.grid_len-1)//2)]
+            return tables.moves_of(empty & self.near)
+        if LIMIT_TO_CLOSE_MOVE:
+            occupied = tables.full & ~empty
+            #At the beginning of the game there are no pieces
+            if not occupied:
+                return [((self.grid_len-1)/2, (self.grid_len-1)/2)]
+            #Reasonable moves are inside the bounding box of the pieces grown by one
+            rows = [r for r in range(self.grid_len) if occupied & tables.row_masks[r]]
+            cols = [c for c in range(self.grid_len) if occupied & tables.col_masks[c]]
+            min_r, max_r = max(0, rows[0]-1), min(self.grid_len-1, rows[-1]+1)
+            min_c, max_c = max(0, cols[0]-1), min(self.grid_len-1, cols[-1]+1)
+            box = 0
+            for r in range(min_r, max_r+1):
+                box |= tables.row_masks[r]
+            col_box = 0
+            for c in range(min_c, max_c+1):
+                col_box |= tables.col_masks[c]
+            empty &= box & col_box
+        return tables.moves_of(empty)
+
+    """
+    returns int - near mask after a stone at ind, None when not using candidates
+    """
+    def next_near(self, ind):
+        if self.near is None:
+            return None
+        return self.near | self.tables.near_masks(CANDIDATE_RADIUS)[ind]
+
+    def get_win_info(self, prev_prev_move):
+        if prev_prev_move is None:
+            return False, None
+        r, c = prev_prev_move
+        bits = self.player_bits(self.tables.move_bits[prev_prev_move])
+        # change win options to one option if off by one and unblocked TODO: gut shot win
+        almost_amt = self.win_amt-1
+        for dr, dc in ((-1, 0), (0, 1), (1, 1), (-1, 1)):
+            count1, block1 = self.get_continuous_info(bits, r, c, dr, dc)
+            count2, block2 = self.get_continuous_info(bits, r, c, -dr, -dc)
+            if count1 + count2 + 1 == almost_amt:
+                if block1:
+                    return True, block1
+                if block2:
+                    return True, block2
+        return False, None
+
+    def get_continuous_info(self, bits, r, c, dr, dc):
+        move_bits = self.tables.move_bits
+        result = 0
+        new_r, new_c = r + dr, c + dc
+        while 0 <= new_r < self.grid_len and 0 <= new_c < self.grid_len:
+            bit = move_bits[(new_r, new_c)]
+            if bits & bit:
+                result += 1
+            elif self.empty & bit:
+                return result, (new_r, new_c)
+            else:
+                return result, None
+            new_r, new_c = new_r + dr, new_c + dc
+        return result, None
+
+    """
+    checks for win via shifted line masks and filled board
+    returns (bool, player) - (terminal, winning_player)
+    """
+    def check_win(self, move):
+        if move is None:
+            return False, None
+        if len(self.options) == 0:
+            #In the unlikely event that no one wins before board is filled
+            #Make white win since black moved first
+            return (True, 'w')
+
+        # only the player that just moved can have completed a line
+        bit = self.tables.move_bits[move]
+        player = 'b' if self.black & bit else 'w'
+        if has_line(self.player_bits(bit), self.tables.shifts, self.win_amt):
+            return True, player
+        return False, None
+
+    """
+    returns int - bitboard of the player owning the piece at bit
+    """
+    def player_bits(self, bit):
+        return self.black if self.black & bit else self.white
+
+
+"""
+returns bool - whether bits contains win_amt pieces in a row along any shift direction
+"""
+def has_line(bits, shifts, win_amt):
+    for d in shifts:
+        line = bits
+        for i in range(1, win_amt):
+            line &= bits >> (i * d)
+            if not line:
+                break
+        if line:
+            return True
+    return False
+
+
+"""
+BitboardTables --
+precomputed per board size masks and lookups
+- stride: int - bits per row (grid_len plus one guard bit)
+- full: int - mask of every real cell
+- move_bits: dict - maps: move -> single bit
+- ind_bits: list - bit for each index of a flat grid
+- row_masks, col_masks: list - mask of every cell in a row/column
+- shifts: tuple - bit offsets for the east, south, south east and south west directions
+- chunk_moves: list - (shift, width mask, moves for every bit pattern) per row chunk of at most CHUNK_BITS cells
+- near_masks(radius) -> list - per cell index, mask of its neighbourhood (built once per radius)
+"""
+class BitboardTables:
+    def __init__(self, grid_len):
+        self.grid_len = grid_len
+        self.stride = grid_len + 1
+        self.move_bits = {}
+        self.ind_bits = []
+        self.bit_moves = {}
+        self.row_masks = [0] * grid_len
+        self.col_masks = [0] * grid_len
+        self.full = 0
+        for r in range(grid_len):
+            for c in range(grid_len):
+                bit = 1 << (r * self.stride + c)
+                self.move_bits[(r, c)] = bit
+                self.ind_bits.append(bit)
+                self.bit_moves[bit] = (r, c)
+                self.row_masks[r] |= bit
+                self.col_masks[c] |= bit
+                self.full |= bit
+        self.shifts = (1, self.stride, self.stride + 1, self.stride - 1)
+        self.near_mask_cache = {}
+
+        # moves_of decodes a whole row chunk with one lookup instead of one bit at a time
+        self.chunk_moves = []
+        for r in range(grid_len):
+            for start in range(0, grid_len, CHUNK_BITS):
+                width = min(CHUNK_BITS, grid_len - start)
+                patterns = []
+                for pattern in range(1 << width):
+                    patterns.append(tuple((r, start + i) for i in range(width) if pattern >> i & 1))
+                self.chunk_moves.append((r * self.stride + start, (1 << width) - 1, patterns))
+
+    """
+    returns list - for every cell index, mask of the cells within radius of it (see candidates.get_neighbours)
+    """
+    def near_masks(self, radius):
+        if radius not in self.near_mask_cache:
+            self.near_mask_cache[radius] = [sum(self.ind_bits[cell] for cell in cells)
+                                            for cells in get_neighbours(self.grid_len, radius)]
+        return self.near_mask_cache[radius]
+
+    """
+    returns list - moves for every set bit of mask
+    """
+    def moves_of(self, mask):
+        moves = []
+        for shift, width_mask, patterns in self.chunk_moves:
+            chunk = (mask >> shift) & width_mask
+            if chunk:
+                moves.extend(patterns[chunk])
+        return moves
+
+
+CHUNK_BITS = 8
+
+_tables = {}
+
+def get_tables(grid_len):
+    if grid_len not in _tables:
+        _tables[grid_len] = BitboardTables(grid_len)
+    return _tables[grid_len]
@@ -1,8 +1,17 @@
 from __future__ import print_function
+import multiprocessing
 import pygame
 from pure_mcts import PureMCTS
 from gomoku_state import *
+from bitboard_state import BitboardGomokuState
+from pattern_state import PatternGomokuState
 from alphazero_mcts import AlphaZeroMCTS
+from parallel_mcts import root_parallel_search, TreeParallelAlphaZeroMCTS
+from ponder import Ponderer
+from node_pool import PooledAlphaZeroMCTS
+from threat_solver import ThreatSolver
+from search_budget import solver_budget
+from metrics import SearchMetrics, JsonLinesSink
 
 ALPHA_ZERO = True
 
@@ -30,6 +39,11 @@ class Board:
         self.game_over = False
         self.grid = []
         self.history = [None, None]
+        # persistent searcher and how many history entries its root has been advanced through
+        self.searcher = None
+        self.searcher_moves = 0
+        self.pool = None # process pool for root parallel search
+        self.ponderer = None # background search on the human's time
         for i in range(self.grid_len):
             self.grid.append(list("." * self.grid_len))
 
@@ -64,25 +78,88 @@ class Board:
 
     #Computer as one of the two players
     def mcts_play(self):
+        self.stop_pondering()
         if not self.game_over:
 
             flat_grid = reduce(lambda x,y: x+y, self.grid)
-            curr_state = GomokuState(flat_grid, self.piece, self.history[-1], self.history[-2], board=None)
-            if ALPHA_ZERO:
-                alphazero_mcts = AlphaZeroMCTS(curr_state)
-                action = alphazero_mcts.uct_search()
+            state_class = BitboardGomokuState if BITBOARD_STATE else GomokuState
+            if PATTERN_STATE:
+                state_class = PatternGomokuState
+            curr_state = state_class(flat_grid, self.piece, self.history[-1], self.history[-2], board=None)
+            forced = None
+            if PARALLEL_WORKERS > 1 and PARALLEL_MODE == 'root' and THREAT_SOLVER:
+                forced = ThreatSolver(self.grid_len, self.win_amt).forced_move(curr_state,
+                                                                               *solver_budget(THINK_TIME, THINK_SECONDS))
+            if forced is not None:
+                action = forced
+                (r, c) = action
+                self.history.append(action)
+                print("Forced move:", action)
+            elif PARALLEL_WORKERS > 1 and PARALLEL_MODE == 'root':
+                # independent trees per process, nothing to reuse between moves
+                if self.pool is None:
+                    self.pool = multiprocessing.Pool(PARALLEL_WORKERS)
+                seed = np.random.randint(2**31 - PARALLEL_WORKERS)
+                action, visits = root_parallel_search(curr_state, PARALLEL_WORKERS, seed, ALPHA_ZERO, pool=self.pool)
+                self.history.append(action)
+                (r, c) = action
+                print("Merged root visits:", visits[action], "of", sum(visits.values()))
             else:
-                pure_mcts = PureMCTS(curr_state)
-                action = pure_mcts.uct_search()
-            (r, c) = action
-            self.history.append(action)
+                searcher = self.get_searcher(curr_state)
+                action = searcher.uct_search()
+                (r, c) = action
+                self.history.append(action)
+            if REUSE_TREE and self.searcher is not None:
+                self.searcher.advance(action)
+                self.searcher_moves = len(self.history)
 
             print("MCTS", self.piece, "move: (", r, ",", c, ")")
             self.set_piece(r, c)
             self.check_win(r, c)
+            self.start_pondering()
 
             # asdf = AlphaZeroMCTS(GomokuState(reduce(lambda x,y: x+y, self.grid), self.piece, self.history[-1], self.history[-2], board=None))
 
+    # searcher for curr_state, reusing the previous tree advanced along the moves played since
+    def get_searcher(self, curr_state):
+        if REUSE_TREE and self.searcher is not None:
+            for action in self.history[self.searcher_moves:]:
+                self.searcher.advance(action)
+            self.searcher_moves = len(self.history)
+            if self.searcher.root.state.grid == curr_state.grid and \
+                    self.searcher.root.state.curr_player == curr_state.curr_player:
+                return self.searcher
+        self.drop_searcher()
+        if ALPHA_ZERO and PARALLEL_WORKERS > 1 and PARALLEL_MODE == 'tree':
+            self.searcher = TreeParallelAlphaZeroMCTS(curr_state, PARALLEL_WORKERS)
+        elif ALPHA_ZERO and NODE_POOL:
+            self.searcher = PooledAlphaZeroMCTS(curr_state)
+        elif ALPHA_ZERO:
+            self.searcher = AlphaZeroMCTS(curr_state)
+        else:
+            self.searcher = PureMCTS(curr_state)
+        if SEARCH_METRICS:
+            SearchMetrics([JsonLinesSink(METRICS_FILE)], METRICS_PROFILE).attach(self.searcher)
+        self.searcher_moves = len(self.history)
+        return self.searcher
+
+    # search the position after the ai's move until the next mcts_play
+    def start_pondering(self):
+        if PONDER and REUSE_TREE and self.searcher is not None and not self.game_over:
+            self.ponderer = Ponderer(self.searcher)
+            self.ponderer.start()
+
+    def stop_pondering(self):
+        if self.ponderer is not None:
+            print("Pondered", self.ponderer.stop(), "simulations")
+            self.ponderer = None
+
+    def drop_searcher(self):
+        self.stop_pondering()
+        if isinstance(self.searcher, TreeParallelAlphaZeroMCTS):
+            self.searcher.close()
+        self.searcher = None
+
     # check if a move causes a win
     def check_win(self, r, c):
         def get_continuous_count(r, c, dr, dc):
@@ -121,6 +198,8 @@ class Board:
         self.winner = None
         self.game_over = False
         self.history = [None, None]
+        self.drop_searcher()
+        self.searcher_moves = 0
     def draw(self, screen):
         # board and lines
         pygame.draw.rect(screen, (185, 122, 87),
@@ -0,0 +1,94 @@
+# Network input planes written straight from a state's grid with numpy
+
+import threading
+
+import numpy as np
+
+EMPTY, BLACK, WHITE = ord('.'), ord('b'), ord('w')
+
+_moves = {}
+
+"""
+returns tuple - (r, c) move of every flat grid index
+"""
+def get_moves(grid_len):
+    if grid_len not in _moves:
+        _moves[grid_len] = tuple((ind // grid_len, ind % grid_len) for ind in range(grid_len * grid_len))
+    return _moves[grid_len]
+
+
+"""
+EncodedBoard --
+network input of a state for the evaluators, drop-in for NNBoardState
+- width, height: int - board size
+- cells: ndarray - uint8 code of every cell ('.', 'b' or 'w'), flat and row major like state.grid
+- legal: ndarray - bool mask of the empty cells, indexed like cells
+- write(out) - fills out, a contiguous (4, height, width) array, with the input planes
+- current_state() -> ndarray - the planes in a new array
+- act_probs(probs) -> list - (action, probability) of every legal cell from the net's output vector
+- act_probs_from_grid(priors) -> list - same from a (height, width) array laid out like the grid
+The planes are laid out like the grid (plane row r is grid row r), which is what NNBoardState's
+upside down board flipped back gave. The net's outputs are indexed on that upside down board, so
+act_probs reads them through a single reversed view instead of mapping every move through
+bad_move_to_good_move and ind_to_move.
+"""
+class EncodedBoard(object):
+    __slots__ = ('width', 'height', 'cells', 'legal', 'player', 'opponent', 'last_move', 'colour')
+
+    def __init__(self, state):
+        n = state.grid_len
+        self.width = n
+        self.height = n
+        self.cells = np.frombuffer(''.join(state.grid), dtype=np.uint8)
+        self.legal = self.cells == EMPTY
+        self.player = BLACK if state.curr_player == 'b' else WHITE
+        self.opponent = WHITE if state.curr_player == 'b' else BLACK
+        self.last_move = state.prev_move[0] * n + state.prev_move[1] if state.prev_move else -1
+        # NNBoardState's colour plane: ones when an even number of stones is down
+        self.colour = 1.0 if (n * n - np.count_nonzero(self.legal)) % 2 == 0 else 0.0
+
+    def write(self, out):
+        planes = out.reshape(4, -1)
+        planes[0] = self.cells == self.player
+        planes[1] = self.cells == self.opponent
+        planes[2] = 0.0
+        if self.last_move >= 0:
+            planes[2, self.last_move] = 1.0
+        planes[3] = self.colour
+
+    def current_state(self):
+        out = np.empty((4, self.height, self.width))
+        self.write(out)
+        return out
+
+    def act_probs(self, probs):
+        return self.act_probs_from_grid(probs.reshape(self.height, self.width)[::-1])
+
+    def act_probs_from_grid(self, priors):
+        legal = np.flatnonzero(self.legal)
+        moves = get_moves(self.width)
+        return zip([moves[ind] for ind in legal], priors.ravel()[legal])
+
+
+_local = threading.local()
+
+"""
+writes the planes of boards into a buffer reused by every call on the same thread
+returns ndarray - (len(boards), 4, height, width) float32 view of the buffer, only valid until the
+thread's next call
+"""
+def encode_batch(boards):
+    n = boards[0].width
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    buffer = buffers.get(n)
+    if buffer is None or len(buffer) < len(boards):
+        size = 1
+        while size < len(boards):
+            size *= 2
+        buffer = buffers[n] = np.empty((size, 4, n, n), dtype=np.float32)
+    batch = buffer[:len(boards)]
+    for board, out in zip(boards, batch):
+        board.write(out)
+    return batch
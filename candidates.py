@@ -0,0 +1,96 @@
+# Candidate moves limited to the neighbourhood of the stones on the board
+
+_neighbours = {}
+
+"""
+returns list - for every cell index, the indices of the other cells within radius of it
+(Chebyshev distance, i.e. the (2*radius+1)^2 square around it clipped to the board)
+"""
+def get_neighbours(grid_len, radius):
+    key = (grid_len, radius)
+    if key not in _neighbours:
+        n = grid_len
+        neighbours = []
+        for r in range(n):
+            for c in range(n):
+                neighbours.append(tuple(nr*n + nc
+                                        for nr in range(max(0, r-radius), min(n, r+radius+1))
+                                        for nc in range(max(0, c-radius), min(n, c+radius+1))
+                                        if (nr, nc) != (r, c)))
+        _neighbours[key] = neighbours
+    return _neighbours[key]
+
+
+"""
+Candidates --
+empty cells within radius of a stone, kept up to date stone by stone
+- counts: list - per cell, stones within radius of it
+- occupied: bytearray - 1 for cells holding a stone
+- cells: set - indices of the candidates (empty cells with a non zero count)
+- place(ind), remove(ind) - add/take back a stone in O(radius^2)
+- actions() -> list - candidate moves in row major order, the centre on an empty board
+States share nothing: copy() before placing the stone of a child state.
+"""
+class Candidates(object):
+    __slots__ = ('grid_len', 'radius', 'neighbours', 'counts', 'occupied', 'cells', 'stones')
+
+    def __init__(self, grid_len, radius):
+        self.grid_len = grid_len
+        self.radius = radius
+        self.neighbours = get_neighbours(grid_len, radius)
+        self.counts = [0] * (grid_len * grid_len)
+        self.occupied = bytearray(grid_len * grid_len)
+        self.cells = set()
+        self.stones = 0
+
+    """
+    returns Candidates - candidates of the stones on grid
+    """
+    @classmethod
+    def from_grid(cls, grid, grid_len, radius):
+        candidates = cls(grid_len, radius)
+        for ind, piece in enumerate(grid):
+            if piece != '.':
+                candidates.place(ind)
+        return candidates
+
+    def copy(self):
+        candidates = Candidates.__new__(Candidates)
+        candidates.grid_len = self.grid_len
+        candidates.radius = self.radius
+        candidates.neighbours = self.neighbours
+        candidates.counts = self.counts[:]
+        candidates.occupied = self.occupied[:]
+        candidates.cells = set(self.cells)
+        candidates.stones = self.stones
+        return candidates
+
+    def place(self, ind):
+        counts = self.counts
+        occupied = self.occupied
+        cells = self.cells
+        for cell in self.neighbours[ind]:
+            counts[cell] += 1
+            if counts[cell] == 1 and not occupied[cell]:
+                cells.add(cell)
+        occupied[ind] = 1
+        cells.discard(ind)
+        self.stones += 1
+
+    def remove(self, ind):
+        counts = self.counts
+        cells = self.cells
+        for cell in self.neighbours[ind]:
+            counts[cell] -= 1
+            if counts[cell] == 0:
+                cells.discard(cell)
+        self.occupied[ind] = 0
+        if counts[ind] > 0:
+            cells.add(ind)
+        self.stones -= 1
+
+    def actions(self):
+        n = self.grid_len
+        if self.stones == 0:
+            return [((n-1)//2, (n-1)//2)]
+        return [(ind // n, ind % n) for ind in sorted(self.cells)]
@@ -1,18 +1,70 @@
 # Game constants
-GRID_LEN = 8
-if GRID_LEN == 6:
-    WIN_AMT = 4
-else:
-    WIN_AMT = 5
+GRID_LEN = 8 # board size of the pygame game and the default for everything else
+
+# stones in a row needed to win on a grid_len x grid_len board
+def win_amt_for(grid_len):
+    return 4 if grid_len == 6 else 5
+
+WIN_AMT = win_amt_for(GRID_LEN)
+MIN_GRID_LEN = 5 # board sizes games can be played on (the pretrained nets only cover 6 and 8)
+MAX_GRID_LEN = 19
 DEBUG_BOARD = False
 LIMIT_TO_WINNING_MOVE = False
 LIMIT_TO_CLOSE_MOVE = False
+CANDIDATE_RADIUS = None # options are the empty cells within this many cells of a stone (None: LIMIT_TO_CLOSE_MOVE rules)
+BITBOARD_STATE = False # use BitboardGomokuState instead of GomokuState
+PATTERN_STATE = False # use PatternGomokuState (incremental line patterns) instead of GomokuState
+PATTERN_PRUNING = True # PatternGomokuState only offers the win or the blocks when a move is forced
 
 # MCTS constants
+FAST_ROLLOUT = True # PureMCTS playouts on a preallocated board instead of new states per ply
 THINK_TIME = 400
+THINK_SECONDS = None # wall-clock budget per move in seconds (None for THINK_TIME simulations only)
+EARLY_STOP = True # stop searching once the root move the searcher would play can't be overtaken
+BUDGET_CHECK_INTERVAL = 16 # simulations between clock reads / early stop checks
+PONDER = True # keep searching in the background while the human thinks (needs REUSE_TREE)
+PONDER_SLICE = 32 # simulations between checks for the human's move
+PONDER_LIMIT = 20000 # max simulations pondered per human move (caps tree memory)
+REUSE_TREE = True # keep the searcher between moves and advance its root along played moves
 DIRICHLET_NOISE = False
+THREAT_SOLVER = True # play wins, forced blocks and VCF/VCT wins found by threat space search without searching
+THREAT_AT_LEAVES = True # AlphaZero leaf values from a short VCF check when it finds a result
+THREAT_NODES = 10000 # threat search nodes per move before giving up
+THREAT_NODES_PER_SIM = 1 # and at most this many per simulation of the move's node budget
+THREAT_TIME_SHARE = 0.25 # share of a move's time budget the threat search may use
+THREAT_CLOCK_INTERVAL = 16 # threat search nodes between clock reads
+THREAT_LEAF_NODES = 100 # threat search nodes per leaf
+THREAT_VCF_DEPTH = 10 # max fours in a row
+THREAT_VCT_DEPTH = 2 # max threes in a line
+PUCT_C = 5 # exploration constant in AlphaZeroMCTS's puct score
+PARALLEL_WORKERS = 1 # search workers per move (1 searches on the calling thread only)
+PARALLEL_MODE = 'root' # 'root': independent trees in a process pool, 'tree': one shared tree
+NODE_POOL = False # AlphaZero search on a numpy NodePool instead of Node objects (single threaded, no transposition table)
+NODE_POOL_CAPACITY = 1 << 16 # initial rows of a NodePool, it doubles when full
+SEARCH_BATCH_SIZE = 1 # leaves per batched nn evaluation in AlphaZeroMCTS
+VIRTUAL_LOSS = 1 # value added per pending visit while a batch is being collected
+TRANSPOSITION_TABLE = False # share node stats/evaluations between transposed positions (AlphaZero: with the same last move)
+TT_SIZE = 200000 # max transposition table entries
+TT_REPLACEMENT = 'lru' # 'lru' or 'min_visits'
+NN_ENGINE = 'gather' # ForwardEngine conv mode for the numpy net: 'gather', 'einsum' or None for the reference pass
+NN_SYMMETRIES = None # 'average': mean over the 8 board symmetries in one batch, 'random': one random symmetry, None: off
+EVAL_CACHE_SIZE = 100000 # max positions in the shared nn evaluation cache (0 disables it, so does NN_SYMMETRIES = 'random')
+EVAL_CACHE_SYMMETRIES = False # share cache entries between rotated/reflected positions
+EVAL_SERVICE = False # one evaluation thread batching the nn calls of every search in the process
+EVAL_BATCH_SIZE = 32 # max boards per batch of the evaluation service
+EVAL_BATCH_WAIT = 0.002 # seconds a request waits for others to join its batch
+
+# Play server constants
+SERVER_PORT = 7777
+SERVER_WORKERS = 2 # threads searching for the server's games
+SERVER_SLICE = 32 # simulations a game searches before yielding its worker to the next game
+SERVER_MAX_SECONDS = 30.0 # cap on (and default for) the time budget of a think request
+SERVER_MAX_SESSIONS = 64 # games hosted at once
 
 # Logging info constants
+SEARCH_METRICS = False # append per search metrics of the game's searcher to METRICS_FILE
+METRICS_FILE = 'search_metrics.jsonl'
+METRICS_PROFILE = False # also sample the searching thread's stack (adds the top functions to each record)
 PRINT_CHILD_STATS = True
 PRINT_PRIORS = False
 PRINT_SEARCH_LEADER = False
@@ -0,0 +1,136 @@
+# LRU cache in front of a policy value network
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from symmetry import NUM_SYMMETRIES, transform_planes, inverse_transform_planes
+
+"""
+EvaluationCache --
+bounded LRU cache of network evaluations keyed by the packed bits of the network input
+- evaluator: object with policy_value_fn(board) and policy_value_batch_fn(boards)
+- max_size: int - max number of cached positions
+- symmetries: bool - key on the canonical form over the 8 board symmetries so one entry
+  serves every rotated/reflected copy of a position
+- hits, misses, evictions: int - counters over every caller
+- thread_counts() -> (int, int) - hits and misses of the lookups made on the calling thread, so a
+  search can tell its own apart from those of searches on other threads
+Entries store the prior over every cell as a (grid_len, grid_len) array in the canonical
+orientation and the value, which doesn't change under symmetries.
+Exposes the same policy_value_fn/policy_value_batch_fn interface as PolicyValueNetNumpy.
+"""
+class EvaluationCache(object):
+    def __init__(self, evaluator, max_size, symmetries=False):
+        self.evaluator = evaluator
+        self.max_size = max_size
+        self.symmetries = symmetries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.local = threading.local()
+
+    """
+    returns (list, float) - ([(action, probability)], value) like PolicyValueNetNumpy.policy_value_fn
+    """
+    def policy_value_fn(self, board):
+        return self.policy_value_batch_fn([board])[0]
+
+    """
+    looks every board up and sends the misses to the evaluator as one batch
+    returns list - (act_probs, value) per board
+    """
+    def policy_value_batch_fn(self, boards):
+        keys = [self.key(board) for board in boards]
+        results = [None] * len(boards)
+        missing = OrderedDict() # maps: key -> indices of boards waiting on it
+        with self.lock:
+            for i, (key, sym) in enumerate(keys):
+                entry = self.lookup(key)
+                if entry is not None:
+                    results[i] = self.act_probs(boards[i], entry, sym)
+                elif key in missing:
+                    missing[key].append(i)
+                else:
+                    missing[key] = [i]
+            self.hits += len(boards) - len(missing)
+            self.misses += len(missing)
+        self.local.hits = getattr(self.local, 'hits', 0) + len(boards) - len(missing)
+        self.local.misses = getattr(self.local, 'misses', 0) + len(missing)
+
+        if missing:
+            miss_boards = [boards[indices[0]] for indices in missing.values()]
+            evaluations = self.evaluator.policy_value_batch_fn(miss_boards)
+            with self.lock:
+                for (key, indices), (act_probs, value) in zip(missing.items(), evaluations):
+                    sym = keys[indices[0]][1]
+                    entry = (transform_planes(self.prior_grid(boards[indices[0]], act_probs), sym).copy(), value)
+                    self.store(key, entry)
+                    results[indices[0]] = (act_probs, value)
+                    for i in indices[1:]:
+                        results[i] = self.act_probs(boards[i], entry, keys[i][1])
+        return results
+
+    """
+    returns (str, int) - (packed network input, symmetry mapping the board to that key)
+    """
+    def key(self, board):
+        planes = board.current_state() != 0
+        if not self.symmetries:
+            return np.packbits(planes).tobytes(), 0
+        candidates = [(np.packbits(transform_planes(planes, sym)).tobytes(), sym)
+                      for sym in range(NUM_SYMMETRIES)]
+        return min(candidates)
+
+    def thread_counts(self):
+        return getattr(self.local, 'hits', 0), getattr(self.local, 'misses', 0)
+
+    """
+    returns ndarray - prior of every grid cell, indexed [r, c]
+    """
+    def prior_grid(self, board, act_probs):
+        priors = np.zeros((board.height, board.width))
+        for (r, c), prob in act_probs:
+            priors[r, c] = prob
+        return priors
+
+    """
+    returns (list, float) - cached entry turned back into the orientation of board
+    """
+    def act_probs(self, board, entry, sym):
+        priors, value = entry
+        return board.act_probs_from_grid(inverse_transform_planes(priors, sym)), value
+
+    def lookup(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.entries[key] = entry
+        return entry
+
+    def store(self, key, entry):
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.entries[key] = entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    """
+    returns dict - size and hit/miss/eviction counters
+    """
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
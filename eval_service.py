@@ -0,0 +1,192 @@
+# Batches network evaluations of concurrent searches into shared forward passes
+#
+#   service = BatchingEvaluator(net)  # one per process and net, searchers on many threads share it
+#   act_probs, value = service.policy_value_fn(board)
+#
+# Each caller blocks until the batch holding its boards has been evaluated. numpy releases the
+# GIL inside the forward pass, so the other searches keep selecting leaves in the meantime.
+
+import threading
+import timeit
+from collections import deque
+
+import numpy as np
+
+from constants import EVAL_BATCH_SIZE, EVAL_BATCH_WAIT
+
+# queueing latencies kept for the percentiles of stats()
+LATENCY_WINDOW = 10000
+
+
+"""
+Request --
+boards waiting in a BatchingEvaluator and, once done is set, their results (or the error raised)
+"""
+class Request(object):
+    __slots__ = ('boards', 'submitted', 'done', 'results', 'error')
+
+    def __init__(self, boards, submitted):
+        self.boards = boards
+        self.submitted = submitted
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+"""
+BatchingEvaluator --
+evaluation service thread in front of an evaluator: requests from any number of threads are queued
+and sent to the evaluator as one policy_value_batch_fn call once max_batch boards are waiting or the
+oldest request has waited max_wait seconds
+- evaluator: object with policy_value_batch_fn(boards)
+- max_batch: int - boards per forward pass (a single larger request is still sent whole)
+- max_wait: float - seconds the first request of a batch may wait for others to join it
+- batch_sizes: dict - maps: boards per flushed batch -> number of batches
+- requests, boards, batches: int - counters
+Exposes the same policy_value_fn/policy_value_batch_fn interface as PolicyValueNetNumpy.
+"""
+class BatchingEvaluator(object):
+    def __init__(self, evaluator, max_batch=EVAL_BATCH_SIZE, max_wait=EVAL_BATCH_WAIT):
+        self.evaluator = evaluator
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self.clock = timeit.default_timer
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.pending_boards = 0
+        self.closed = False
+
+        self.requests = 0
+        self.boards = 0
+        self.batches = 0
+        self.batch_sizes = {}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.evaluation_seconds = 0.0
+
+        self.worker = threading.Thread(target=self.run, name="BatchingEvaluator")
+        self.worker.daemon = True
+        self.worker.start()
+
+    """
+    returns (list, float) - ([(action, probability)], value) like PolicyValueNetNumpy.policy_value_fn
+    """
+    def policy_value_fn(self, board):
+        return self.policy_value_batch_fn([board])[0]
+
+    """
+    queues boards and waits for their batch
+    returns list - (act_probs, value) per board
+    """
+    def policy_value_batch_fn(self, boards):
+        if not boards:
+            return []
+        request = Request(list(boards), self.clock())
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Evaluation service is closed")
+            self.pending.append(request)
+            self.pending_boards += len(request.boards)
+            self.condition.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            self.evaluate(batch)
+
+    """
+    waits for a batch to fill up or for its first request to time out
+    returns list - requests to evaluate together, None once closed
+    """
+    def next_batch(self):
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return None
+            deadline = self.pending[0].submitted + self.max_wait
+            while self.pending_boards < self.max_batch and not self.closed:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            batch = [self.pending.popleft()]
+            num_boards = len(batch[0].boards)
+            while self.pending and num_boards + len(self.pending[0].boards) <= self.max_batch:
+                batch.append(self.pending.popleft())
+                num_boards += len(batch[-1].boards)
+            self.pending_boards -= num_boards
+            return batch
+
+    def evaluate(self, batch):
+        start = self.clock()
+        boards = [board for request in batch for board in request.boards]
+        try:
+            results = self.evaluator.policy_value_batch_fn(boards)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+        self.record(batch, len(boards), start)
+        i = 0
+        for request in batch:
+            request.results = results[i:i + len(request.boards)]
+            i += len(request.boards)
+            request.done.set()
+
+    def record(self, batch, num_boards, start):
+        self.evaluation_seconds += self.clock() - start
+        self.requests += len(batch)
+        self.boards += num_boards
+        self.batches += 1
+        self.batch_sizes[num_boards] = self.batch_sizes.get(num_boards, 0) + 1
+        for request in batch:
+            latency = start - request.submitted
+            self.latencies.append(latency)
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    """
+    returns dict - counters, mean boards per batch, batch size histogram and queueing latency
+    (seconds from submitting a request to its batch going to the evaluator) mean, max and
+    percentiles over the last LATENCY_WINDOW requests
+    """
+    def stats(self):
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {
+            'requests': self.requests,
+            'boards': self.boards,
+            'batches': self.batches,
+            'mean_batch': float(self.boards) / self.batches if self.batches else 0.0,
+            'batch_sizes': dict(self.batch_sizes),
+            'latency_mean': self.total_latency / self.requests if self.requests else 0.0,
+            'latency_max': self.max_latency,
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p95': float(np.percentile(latencies, 95)),
+            'evaluation_seconds': self.evaluation_seconds,
+        }
+
+    """
+    stops the service thread, requests still queued fail with an error
+    returns nothing
+    """
+    def close(self):
+        with self.condition:
+            self.closed = True
+            pending = list(self.pending)
+            self.pending.clear()
+            self.pending_boards = 0
+            self.condition.notify_all()
+        for request in pending:
+            request.error = RuntimeError("Evaluation service is closed")
+            request.done.set()
+        self.worker.join()
@@ -22,6 +22,7 @@ class Gomoku():
             self.update()
             self.draw()
             self.clock.tick(60)
+        self.board.stop_pondering()
         print("Game finished.")
         pygame.quit()
 
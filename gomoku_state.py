@@ -1,14 +1,29 @@
 from state import State
 import copy
+import math
 
 from constants import *
+from zobrist import get_zobrist_keys, zobrist_hash
+from candidates import Candidates
 
 class GomokuState(State):
 
-    def __init__(self, grid, curr_player, prev_move, prev_prev_move, board=None):
+    """
+    grid: list - grid_len*grid_len cells, the board size is taken from its length
+    zobrist: int - hash of grid if already known (apply_action updates it incrementally)
+    win_amt: int - stones in a row to win, win_amt_for(grid_len) if not given
+    candidates: Candidates - neighbourhood of the stones on grid if already known, built when
+    CANDIDATE_RADIUS is set (options are then the candidates)
+    """
+    def __init__(self, grid, curr_player, prev_move, prev_prev_move, board=None, zobrist=None, win_amt=None,
+                 candidates=None):
         self.grid = grid
-        self.grid_len = GRID_LEN
-        self.win_amt = WIN_AMT
+        self.grid_len = grid_len_of(grid)
+        self.win_amt = win_amt if win_amt is not None else win_amt_for(self.grid_len)
+        self.zobrist = zobrist if zobrist is not None else zobrist_hash(grid, self.grid_len)
+        if candidates is None and CANDIDATE_RADIUS:
+            candidates = Candidates.from_grid(grid, self.grid_len, CANDIDATE_RADIUS)
+        self.candidates = candidates
         self.options = self.get_options() # must be called before check_win
 
         if DEBUG_BOARD:
@@ -39,10 +54,13 @@ class GomokuState(State):
     def apply_action(self, action):
         # TODO: optimize
         next_grid = copy.copy(self.grid)
-        if next_grid[move_to_ind(action)] == '.':
-            next_grid[move_to_ind(action)] = self.curr_player
+        ind = move_to_ind(action, self.grid_len)
+        if next_grid[ind] == '.':
+            next_grid[ind] = self.curr_player
             next_player = 'w' if self.curr_player == 'b' else 'b'
-            next_state = GomokuState(next_grid, next_player, action, self.prev_move, self.board)
+            next_zobrist = self.zobrist ^ get_zobrist_keys(self.grid_len)[self.curr_player][ind]
+            next_state = GomokuState(next_grid, next_player, action, self.prev_move, self.board, next_zobrist,
+                                     self.win_amt, self.next_candidates(ind))
             if self.board:
                 self.board.set_piece(action[0],action[1])
             return next_state
@@ -54,37 +72,34 @@ class GomokuState(State):
     returns list - list of reasonable actions
     """
     def get_options(self):
+        if self.candidates is not None:
+            return self.candidates.actions()
         grid = self.grid
-        #collect all occupied spots
-        current_pcs = []
-        for r in range(self.grid_len):
-            for c in range(self.grid_len):
-                move = (r,c)
-                if not grid[move_to_ind(move)] == '.':
-                    current_pcs.append((r,c))
-        #Options of reasonable next step moves
-        options = []
+        n = self.grid_len
         if LIMIT_TO_CLOSE_MOVE:
+            #collect all occupied spots
+            current_pcs = [ind for ind, piece in enumerate(grid) if piece != '.']
             #At the beginning of the game, curernt_pcs is empty
             if not current_pcs:
-                return [((self.grid_len-1)/2, (self.grid_len-1)/2)]
-            #Reasonable moves should be close to where the current players are
-            #Think about what these calculations are doing
-            #min(list, key=lambda x: x[0]) picks the element with the min value on the first dimension
-            min_r = max(0, min(current_pcs, key=lambda x: x[0])[0]-1)
-            max_r = min(self.grid_len-1, max(current_pcs, key=lambda x: x[0])[0]+1)
-            min_c = max(0, min(current_pcs, key=lambda x: x[1])[1]-1)
-            max_c = min(self.grid_len-1, max(current_pcs, key=lambda x: x[1])[1]+1)
-            for i in range(min_r, max_r+1):
-                for j in range(min_c, max_c+1):
-                    if not (i, j) in current_pcs:
-                        options.append((i,j))
-        else:
-            for i in range(self.grid_len):
-                for j in range(self.grid_len):
-                    if not (i, j) in current_pcs:
-                        options.append((i,j))
-        return options
+                return [((n-1)/2, (n-1)/2)]
+            #Reasonable moves should be close to where the current players are: the bounding box grown by one
+            rows = [ind // n for ind in current_pcs]
+            cols = [ind % n for ind in current_pcs]
+            min_r, max_r = max(0, min(rows)-1), min(n-1, max(rows)+1)
+            min_c, max_c = max(0, min(cols)-1), min(n-1, max(cols)+1)
+            return [(i, j) for i in range(min_r, max_r+1) for j in range(min_c, max_c+1) if grid[i*n + j] == '.']
+        # one pass over the grid, row major like the moves
+        return [(ind // n, ind % n) for ind, piece in enumerate(grid) if piece == '.']
+
+    """
+    returns Candidates - candidates after a stone at ind, None when not using candidates
+    """
+    def next_candidates(self, ind):
+        if self.candidates is None:
+            return None
+        candidates = self.candidates.copy()
+        candidates.place(ind)
+        return candidates
 
     def get_win_info(self, prev_prev_move):
         if prev_prev_move is None:
@@ -116,16 +131,16 @@ class GomokuState(State):
 
     def get_continuous_info(self, r, c, dr, dc):
         move = (r, c)
-        player = self.grid[move_to_ind(move)]
+        player = self.grid[move_to_ind(move, self.grid_len)]
         result = 0
         i = 1
         while True:
             new_r = r + dr * i
             new_c = c + dc * i
             new_move = (new_r, new_c)
-            if 0 <= new_r < self.grid_len and 0 <= new_c < self.grid_len and self.grid[move_to_ind(new_move)] == player:
+            if 0 <= new_r < self.grid_len and 0 <= new_c < self.grid_len and self.grid[move_to_ind(new_move, self.grid_len)] == player:
                 result += 1
-            elif 0 <= new_r < self.grid_len and 0 <= new_c < self.grid_len and self.grid[move_to_ind(new_move)] == '.':
+            elif 0 <= new_r < self.grid_len and 0 <= new_c < self.grid_len and self.grid[move_to_ind(new_move, self.grid_len)] == '.':
                 return result, (new_r,new_c)
             else:
                 return result, None
@@ -155,19 +170,19 @@ class GomokuState(State):
         sw_count = self.get_continuous_count(r, c, 1, -1)
         if (n_count + s_count + 1 >= self.win_amt) or (e_count + w_count + 1 >= self.win_amt) or \
                 (se_count + nw_count + 1 >= self.win_amt) or (ne_count + sw_count + 1 >= self.win_amt):
-            return True, self.grid[move_to_ind(move)]
+            return True, self.grid[move_to_ind(move, self.grid_len)]
         return False, None
 
     def get_continuous_count(self, r, c, dr, dc):
         move = (r,c)
-        player = self.grid[move_to_ind(move)]
+        player = self.grid[move_to_ind(move, self.grid_len)]
         result = 0
         i = 1
         while True:
             new_r = r + dr * i
             new_c = c + dc * i
             new_move = (new_r, new_c)
-            if 0 <= new_r < self.grid_len and 0 <= new_c < self.grid_len and self.grid[move_to_ind(new_move)] == player:
+            if 0 <= new_r < self.grid_len and 0 <= new_c < self.grid_len and self.grid[move_to_ind(new_move, self.grid_len)] == player:
                 result += 1
             else:
                 return result
@@ -176,36 +191,45 @@ class GomokuState(State):
 
 # utils
 
-def move_to_ind(move):
-    grid_len = GRID_LEN
+def move_to_ind(move, grid_len=GRID_LEN):
     r, c = move
     return grid_len*r + c
 
-def ind_to_move(ind):
-    grid_len = GRID_LEN
+def ind_to_move(ind, grid_len=GRID_LEN):
     return ind // grid_len, ind % grid_len
 
+_grid_lens = {}
+
+"""
+returns int - side of the square board a flat grid holds
+"""
+def grid_len_of(grid):
+    cells = len(grid)
+    if cells not in _grid_lens:
+        _grid_lens[cells] = int(round(math.sqrt(cells)))
+    return _grid_lens[cells]
+
 
 
 
 import numpy as np
 
-def bad_move_to_good_move(bad_move):
-    bad_location = ind_to_move(bad_move)
-    good_location = (GRID_LEN-1-bad_location[0], bad_location[1])
-    good_move = move_to_ind(good_location)
+def bad_move_to_good_move(bad_move, grid_len=GRID_LEN):
+    bad_location = ind_to_move(bad_move, grid_len)
+    good_location = (grid_len-1-bad_location[0], bad_location[1])
+    good_move = move_to_ind(good_location, grid_len)
     return good_move
 
 class NNBoardState(object):
     """board for the game"""
 
     def __init__(self, state):
-        self.width = GRID_LEN
-        self.height = GRID_LEN
-        self.n_in_row = int(WIN_AMT)
+        self.width = state.grid_len
+        self.height = state.grid_len
+        self.n_in_row = int(state.win_amt)
         self.players = [1, 2]  # player1 and player2
         self.current_player = state.curr_player
-        self.last_move = self.location_to_move((GRID_LEN-1-state.prev_move[0], state.prev_move[1])) if state.prev_move else -1
+        self.last_move = self.location_to_move((self.height-1-state.prev_move[0], state.prev_move[1])) if state.prev_move else -1
         self.availables = list(range(self.width * self.height))
         # board states stored as a dict,
         # key: move
@@ -214,7 +238,7 @@ class NNBoardState(object):
         for i in range(len(state.grid)):
             if state.grid[i] != '.':
                 bad_move = i
-                good_move = bad_move_to_good_move(bad_move)
+                good_move = bad_move_to_good_move(bad_move, self.width)
                 self.states[good_move] = 1 if state.grid[i] == 'b' else 2
 
 
@@ -261,3 +285,19 @@ class NNBoardState(object):
         if len(self.states) % 2 == 0:
             square_state[3][:, :] = 1.0  # indicate the colour to play
         return square_state[:, ::-1, :]
+
+    def write(self, out):
+        """fill out, a (4, height, width) array, with current_state()"""
+        out[...] = self.current_state()
+
+    def act_probs(self, probs):
+        """return (action, probability) of every move in availables,
+        probs indexed like the net's output (i.e. this board's moves)
+        """
+        n = self.width
+        good_legal_pos = [bad_move_to_good_move(pos, n) for pos in self.availables]
+        return zip([ind_to_move(pos, n) for pos in good_legal_pos], probs[self.availables])
+
+    def act_probs_from_grid(self, priors):
+        """same as act_probs, priors laid out like current_state()"""
+        return self.act_probs(priors[::-1].ravel())
@@ -0,0 +1,281 @@
+# Structured per-search metrics for PureMCTS and AlphaZeroMCTS
+#
+#   metrics = SearchMetrics([JsonLinesSink('search_metrics.jsonl')])
+#   metrics.attach(searcher)
+#
+# Searchers without metrics attached run their plain methods, so there's no cost when disabled.
+
+import json
+import sys
+import threading
+import time
+import timeit
+from collections import defaultdict
+
+PHASES = ('selection', 'expansion', 'evaluation', 'backup')
+
+# searcher method name -> phase its (exclusive) time is charged to
+PHASE_METHODS = {
+    'tree_policy': 'selection',
+    'select_leaf': 'selection',
+    'ucb_action_child': 'selection',
+    'ucb_child': 'selection',
+    'expand': 'expansion',
+    'expand_all': 'expansion',
+    'child_node': 'expansion',
+    'evaluate': 'evaluation',
+    'evaluate_boards': 'evaluation',
+    'default_policy': 'evaluation',
+    'backup': 'backup',
+    'add_virtual_loss': 'backup',
+}
+
+"""
+SearchMetrics --
+times the phases of every search of the searchers it's attached to and sends one record
+per search to its sinks
+- sinks: list - objects with write(record)
+- profile: bool - also run a SamplingProfiler over each search and add its top functions
+- tags: dict - extra fields added to every record (e.g. which agent searched)
+- last: dict - record of the most recent search
+evaluations/evaluated_boards count the searcher's policy_value_fn/evaluate_boards calls and their
+boards, cache hits included; cache_hits/cache_misses split them by the lookups the search's own
+threads made in the (process wide) evaluation cache, and nn_boards is the boards that reached the
+network: the cache misses, or every evaluated board without a cache
+Phase times are exclusive: time in a nested phase (e.g. the evaluation done while expanding)
+only counts towards the inner one.
+"""
+class SearchMetrics(object):
+    def __init__(self, sinks=None, profile=False, tags=None):
+        self.sinks = sinks or []
+        self.profile = profile
+        self.tags = tags or {}
+        self.last = None
+        self.clock = timeit.default_timer
+
+    """
+    instruments searcher: wraps its phase methods on the instance and makes its search()
+    call begin/end
+    returns nothing
+    """
+    def attach(self, searcher):
+        searcher.metrics = self
+        for name, phase in PHASE_METHODS.items():
+            method = getattr(searcher, name, None)
+            if method is not None:
+                setattr(searcher, name, self.timed(phase, method))
+        cache = getattr(searcher, 'evaluator', None)
+        if not hasattr(cache, 'thread_counts'):
+            cache = None
+        if hasattr(searcher, 'policy_value_fn'):
+            searcher.policy_value_fn = self.counted(searcher.policy_value_fn, lambda args: 1, cache)
+        if hasattr(searcher, 'evaluate_boards'):
+            searcher.evaluate_boards = self.counted(searcher.evaluate_boards, lambda args: len(args[0]), cache)
+
+    """
+    removes everything attach added
+    returns nothing
+    """
+    def detach(self, searcher):
+        for name in list(PHASE_METHODS) + ['evaluate_boards', 'metrics']:
+            searcher.__dict__.pop(name, None)
+        if hasattr(searcher, 'policy_value_fn'):
+            searcher.policy_value_fn = searcher.evaluator.policy_value_fn
+
+    def timed(self, phase, fn):
+        clock = self.clock
+        def timed_fn(*args, **kwargs):
+            self.nested.append(0.0)
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                self.phase_seconds[phase] += elapsed - self.nested.pop()
+                if self.nested:
+                    self.nested[-1] += elapsed
+        return timed_fn
+
+    """
+    cache: EvaluationCache - evaluator fn goes through, its hits/misses on the calling thread
+    during the call are added to this search's
+    """
+    def counted(self, fn, num_boards, cache=None):
+        def counted_fn(*args, **kwargs):
+            self.evaluations += 1
+            self.evaluated_boards += num_boards(args)
+            if cache is None:
+                return fn(*args, **kwargs)
+            hits, misses = cache.thread_counts()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                new_hits, new_misses = cache.thread_counts()
+                self.cache_hits += new_hits - hits
+                self.cache_misses += new_misses - misses
+        return counted_fn
+
+    """
+    called by search() before its first simulation
+    returns nothing
+    """
+    def begin(self, searcher):
+        self.phase_seconds = dict((phase, 0.0) for phase in PHASES)
+        self.nested = []
+        self.evaluations = 0
+        self.evaluated_boards = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cached = hasattr(getattr(searcher, 'evaluator', None), 'thread_counts')
+        self.counters_at_begin = self.counters(searcher)
+        self.profiler = SamplingProfiler(threading.current_thread()) if self.profile else None
+        if self.profiler is not None:
+            self.profiler.start()
+        self.start = self.clock()
+
+    """
+    called by search() when it returns, builds the record and writes it to every sink
+    returns dict - the record
+    """
+    def end(self, searcher, simulations):
+        seconds = self.clock() - self.start
+        record = dict(self.tags)
+        record.update({
+            'time': time.time(),
+            'searcher': searcher.__class__.__name__,
+            'simulations': simulations,
+            'seconds': seconds,
+            'simulations_per_second': simulations / seconds if seconds > 0 else 0.0,
+            'phases': self.phase_seconds,
+            'other_seconds': seconds - sum(self.phase_seconds.values()),
+            'evaluations': self.evaluations,
+            'evaluated_boards': self.evaluated_boards,
+            'root_visits': int(searcher.root.visits),
+        })
+        record.update(searcher.tree_stats() if hasattr(searcher, 'tree_stats') else tree_stats(searcher.root))
+        counters = self.counters(searcher)
+        for key, value in counters.items():
+            record[key] = value - self.counters_at_begin.get(key, 0)
+        if self.cached:
+            record['cache_hits'] = self.cache_hits
+            record['cache_misses'] = self.cache_misses
+        record['nn_boards'] = self.cache_misses if self.cached else self.evaluated_boards
+        if self.profiler is not None:
+            record['profile'] = self.profiler.stop()
+
+        self.last = record
+        for sink in self.sinks:
+            sink.write(record)
+        return record
+
+    """
+    returns dict - cumulative transposition table counters of searcher (the table is the
+    searcher's own, unlike the evaluation cache)
+    """
+    def counters(self, searcher):
+        counters = {}
+        table = getattr(searcher, 'transposition_table', None)
+        if table is not None:
+            counters['tt_hits'] = table.hits
+            counters['tt_misses'] = table.misses
+        return counters
+
+
+"""
+walks the tree under root
+returns dict - tree_nodes: nodes in the tree, tree_depth: depth of the deepest node,
+node_bytes: rough estimate of the memory held by the nodes, their states and edges
+"""
+def tree_stats(root):
+    nodes = 0
+    depth = 0
+    node_bytes = 0
+    stack = [(root, 0)]
+    while stack:
+        node, node_depth = stack.pop()
+        nodes += 1
+        depth = max(depth, node_depth)
+        node_bytes += sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof(node.all_actions)
+        node_bytes += sys.getsizeof(node.state) + sys.getsizeof(getattr(node.state, '__dict__', None))
+        edges = getattr(node, 'edges', None)
+        if edges is not None:
+            node_bytes += edges.priors.nbytes + edges.visits.nbytes + edges.values.nbytes
+        children = node.children if hasattr(node, 'children') else node.action_children
+        node_bytes += sys.getsizeof(children)
+        for child in children.values():
+            stack.append((child, node_depth + 1))
+    return {'tree_nodes': nodes, 'tree_depth': depth, 'node_bytes': node_bytes}
+
+
+"""
+CallbackSink --
+passes every record to fn
+"""
+class CallbackSink(object):
+    def __init__(self, fn):
+        self.fn = fn
+
+    def write(self, record):
+        self.fn(record)
+
+"""
+JsonLinesSink --
+appends every record as one line of json to a file
+"""
+class JsonLinesSink(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+"""
+SamplingProfiler --
+background thread sampling the stack of another thread every interval seconds
+- thread: threading.Thread - thread to sample
+- stop() -> list - [function, self samples, total samples] for the top functions, most self samples first
+A function is "file:name"; self samples count it at the top of the stack, total samples anywhere on it.
+"""
+class SamplingProfiler(object):
+    def __init__(self, thread, interval=0.001, top=20):
+        self.thread_id = thread.ident
+        self.interval = interval
+        self.top = top
+        self.self_samples = defaultdict(int)
+        self.total_samples = defaultdict(int)
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=self.run)
+        self.sampler.daemon = True
+
+    def start(self):
+        self.sampler.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.self_samples[function_name(frame)] += 1
+            seen = set()
+            while frame is not None:
+                name = function_name(frame)
+                if name not in seen:
+                    seen.add(name)
+                    self.total_samples[name] += 1
+                frame = frame.f_back
+
+    def stop(self):
+        self.stop_event.set()
+        self.sampler.join()
+        names = sorted(self.total_samples, key=lambda name: (self.self_samples[name], self.total_samples[name]),
+                       reverse=True)
+        return [[name, self.self_samples[name], self.total_samples[name]] for name in names[:self.top]]
+
+def function_name(frame):
+    code = frame.f_code
+    return "{}:{}".format(code.co_filename.rsplit('/', 1)[-1], code.co_name)
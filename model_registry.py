@@ -0,0 +1,127 @@
+# Process-wide cache of pretrained policy value networks
+
+import os
+import pickle
+import threading
+
+import numpy as np
+
+from constants import EVAL_CACHE_SIZE, EVAL_CACHE_SYMMETRIES, NN_ENGINE, NN_SYMMETRIES, EVAL_SERVICE
+from eval_cache import EvaluationCache
+from eval_service import BatchingEvaluator
+from symmetric_eval import SymmetricEvaluator
+from policy_value_net_numpy import PolicyValueNetNumpy, ForwardEngine
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_FILES = {
+    6: 'best_policy_6_6_4.model',
+    8: 'best_policy_8_8_5.model',
+}
+
+# conv layer weights in the pretrained params list (theano layout, filters not yet flipped)
+CONV_WEIGHT_INDICES = (0, 2, 4, 6, 10)
+# max difference allowed between a ForwardEngine and the reference forward pass
+ENGINE_TOLERANCE = 1e-4
+
+_nets = {}
+_evaluators = {}
+_services = {}
+_lock = threading.Lock()
+
+"""
+shared net for a board size, each weight file is only unpickled once per process
+grid_len: int - board size used to pick the default model file
+model_file: str - optional path to a weight file, overrides the default for grid_len
+returns PolicyValueNetNumpy - net with contiguous float32 params and pre-flipped conv filters,
+running on a ForwardEngine (checked against the reference pass once) unless NN_ENGINE is None
+"""
+def get_policy_value_net(grid_len, model_file=None):
+    model_path = resolve_model_path(grid_len, model_file)
+    key = (grid_len, model_path)
+    net = _nets.get(key)
+    if net is None:
+        with _lock:
+            net = _nets.get(key)
+            if net is None:
+                with open(model_path, 'rb') as f:
+                    policy_params = pickle.load(f)
+                params = prepare_params(policy_params)
+                net = PolicyValueNetNumpy(grid_len, grid_len, params, flipped_filters=True)
+                if NN_ENGINE is not None:
+                    engine = ForwardEngine(grid_len, grid_len, params, flipped_filters=True, mode=NN_ENGINE)
+                    error = engine.max_error(net)
+                    if error > ENGINE_TOLERANCE:
+                        raise RuntimeError("Forward engine differs from the reference pass by {}".format(error))
+                    net.engine = engine
+                _nets[key] = net
+    return net
+
+"""
+shared evaluator searchers should call, the net from get_policy_value_net behind a
+SymmetricEvaluator if NN_SYMMETRIES is set, a BatchingEvaluator merging the evaluations of
+concurrent searches if EVAL_SERVICE is set and an EvaluationCache (shared by every search in the
+process, so hits never wait for a batch) unless EVAL_CACHE_SIZE is 0 or NN_SYMMETRIES is 'random'
+(an evaluation under a random symmetry reused by later games would make them depend on earlier ones)
+returns object - evaluator with policy_value_fn(board) and policy_value_batch_fn(boards)
+"""
+def get_evaluator(grid_len, model_file=None):
+    net = get_policy_value_net(grid_len, model_file)
+    cache_size = EVAL_CACHE_SIZE if NN_SYMMETRIES != 'random' else 0
+    if not cache_size and not NN_SYMMETRIES and not EVAL_SERVICE:
+        return net
+    key = (grid_len, resolve_model_path(grid_len, model_file))
+    evaluator = _evaluators.get(key)
+    if evaluator is None:
+        with _lock:
+            evaluator = _evaluators.get(key)
+            if evaluator is None:
+                evaluator = net
+                if NN_SYMMETRIES:
+                    evaluator = SymmetricEvaluator(evaluator, NN_SYMMETRIES)
+                if EVAL_SERVICE:
+                    evaluator = BatchingEvaluator(evaluator)
+                    _services[key] = evaluator
+                if cache_size:
+                    evaluator = EvaluationCache(evaluator, cache_size, EVAL_CACHE_SYMMETRIES)
+                _evaluators[key] = evaluator
+    return evaluator
+
+"""
+returns BatchingEvaluator - the service behind get_evaluator for grid_len, None if EVAL_SERVICE
+is off or no evaluator was made yet
+"""
+def get_eval_service(grid_len, model_file=None):
+    return _services.get((grid_len, resolve_model_path(grid_len, model_file)))
+
+"""
+returns str - absolute path of the weight file for grid_len
+"""
+def resolve_model_path(grid_len, model_file=None):
+    if model_file is None:
+        if grid_len not in MODEL_FILES:
+            raise ValueError("No pretrained model for a {0}x{0} board".format(grid_len))
+        model_file = os.path.join(MODEL_DIR, MODEL_FILES[grid_len])
+    return os.path.abspath(model_file)
+
+"""
+returns list - params as contiguous float32 arrays with the conv filters rotated 180 degrees
+so conv_forward doesn't have to flip them on every call
+"""
+def prepare_params(policy_params):
+    params = []
+    for i, param in enumerate(policy_params):
+        if i in CONV_WEIGHT_INDICES:
+            param = param[:, :, ::-1, ::-1]
+        params.append(np.ascontiguousarray(param, dtype=np.float32))
+    return params
+
+"""
+drops every cached net and evaluator (mostly useful after swapping weight files on disk)
+"""
+def clear_cache():
+    with _lock:
+        for service in _services.values():
+            service.close()
+        _nets.clear()
+        _evaluators.clear()
+        _services.clear()
@@ -0,0 +1,333 @@
+# Array backed search tree for AlphaZeroMCTS style searches
+
+from math import sqrt
+
+import numpy as np
+
+from constants import THINK_TIME, THINK_SECONDS, EARLY_STOP, PUCT_C, DIRICHLET_NOISE, PRINT_CHILD_STATS, \
+    NODE_POOL_CAPACITY, THREAT_SOLVER, THREAT_AT_LEAVES
+from search_budget import SearchBudget, deadline_after, solver_budget
+from threat_solver import ThreatSolver
+
+# column name -> dtype, one row per node (28 bytes a node)
+COLUMNS = (
+    ('parent', np.int32),       # row of the parent, -1 for the root
+    ('first_child', np.int32),  # row of the first child, children of a node are contiguous rows
+    ('num_children', np.int16), # 0 until expanded
+    ('action', np.int16),       # action from the parent, encoded as r*grid_len + c
+    ('prior', np.float32),      # nn prior of action
+    ('visits', np.int32),
+    ('value', np.float64),      # value sum from the perspective of the player moving at the node
+)
+
+"""
+NodePool --
+tree nodes stored as rows of preallocated numpy columns (see COLUMNS), grown by doubling
+- size: int - rows in use
+- allocate(count) -> int - first of count new contiguous rows
+- compact(root) -> (NodePool, int) - copy of the subtree under root and the root's row in it
+"""
+class NodePool(object):
+    def __init__(self, capacity=NODE_POOL_CAPACITY):
+        self.capacity = max(1, capacity)
+        self.size = 0
+        for name, dtype in COLUMNS:
+            setattr(self, name, np.zeros(self.capacity, dtype=dtype))
+
+    def __len__(self):
+        return self.size
+
+    """
+    returns int - row of the first of count new rows, with no parent, children or stats
+    """
+    def allocate(self, count):
+        if self.size + count > self.capacity:
+            self.grow(self.size + count)
+        start = self.size
+        self.size += count
+        self.parent[start:self.size] = -1
+        self.first_child[start:self.size] = -1
+        self.num_children[start:self.size] = 0
+        self.visits[start:self.size] = 0
+        self.value[start:self.size] = 0
+        return start
+
+    def grow(self, min_capacity):
+        capacity = self.capacity
+        while capacity < min_capacity:
+            capacity *= 2
+        for name, dtype in COLUMNS:
+            column = np.zeros(capacity, dtype=dtype)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def compact(self, root):
+        pool = NodePool(max(self.capacity // 2, 1))
+        new_root = pool.allocate(1)
+        self.copy_rows(pool, root, new_root, 1)
+        pool.parent[new_root] = -1
+        stack = [(root, new_root)]
+        while stack:
+            old, new = stack.pop()
+            count = int(self.num_children[old])
+            if count == 0:
+                continue
+            first = int(self.first_child[old])
+            block = pool.allocate(count)
+            self.copy_rows(pool, first, block, count)
+            pool.parent[block:block + count] = new
+            pool.first_child[new] = block
+            for k in range(count):
+                if self.num_children[first + k] > 0:
+                    stack.append((first + k, block + k))
+        return pool, new_root
+
+    def copy_rows(self, pool, start, new_start, count):
+        for name, dtype in COLUMNS:
+            getattr(pool, name)[new_start:new_start + count] = getattr(self, name)[start:start + count]
+
+    """
+    returns int - bytes held by the columns
+    """
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name, dtype in COLUMNS)
+
+
+"""
+PoolNode --
+view of the root row with its state, for code written against Node (root.state, root.terminal, root.visits)
+"""
+class PoolNode(object):
+    def __init__(self, pool, index, state):
+        self.pool = pool
+        self.index = index
+        self.state = state
+        self.terminal = state.terminal
+
+    @property
+    def visits(self):
+        return int(self.pool.visits[self.index])
+
+    @property
+    def value(self):
+        return float(self.pool.value[self.index])
+
+
+"""
+PooledAlphaZeroMCTS --
+AlphaZeroMCTS on a NodePool: nodes are rows instead of objects and only the root state is kept,
+every other state is recomputed by applying actions on the way down. Same puct selection, backup
+and move choice as AlphaZeroMCTS; one leaf per simulation, no transposition table.
+Actions must be (r, c) moves of a state with grid_len.
+- root: PoolNode
+- uct_search, choose_action, search, root_visits, advance: as AlphaZeroMCTS
+- tree_stats() -> dict - node count, depth and bytes of the tree
+"""
+class PooledAlphaZeroMCTS:
+    metrics = None # metrics.SearchMetrics, set by its attach()
+
+    def __init__(self, root_state, model_file=None, c=PUCT_C, capacity=NODE_POOL_CAPACITY):
+        self.c = c
+        self.grid_len = root_state.grid_len
+        self.pool = NodePool(capacity)
+        self.root = PoolNode(self.pool, self.pool.allocate(1), root_state)
+        self.solver = ThreatSolver(root_state.grid_len, root_state.win_amt)
+        from model_registry import get_evaluator
+        self.evaluator = get_evaluator(self.grid_len, model_file)
+        self.policy_value_fn = self.evaluator.policy_value_fn
+
+    """
+    main algo loop, stops at whichever of the node and time budgets runs out first
+    returns action - action sampled according to policy vector
+    """
+    def uct_search(self, simulations=THINK_TIME, time_budget=THINK_SECONDS):
+        # the threat search's time comes out of the move's time budget
+        deadline = deadline_after(time_budget)
+        action = self.forced_move(*solver_budget(simulations, time_budget))
+        if action is not None:
+            print("Forced move: {}".format(action))
+            return action
+
+        self.search(simulations, deadline)
+
+        if PRINT_CHILD_STATS:
+            print("Child stats---")
+            pool = self.pool
+            children = self.children(self.root.index)
+            for i in children[np.argsort(-pool.visits[children], kind='mergesort')]:
+                visits = pool.visits[i]
+                q_val = -pool.value[i]/visits if visits > 0 else 0
+                print("Action: {}, Visits: {} Qval: {} Prior: {}".format(self.decode(pool.action[i]), visits, q_val, pool.prior[i]))
+
+        return self.choose_action()
+
+    """
+    returns action - action sampled according to policy vector (most visited root child)
+    """
+    def choose_action(self):
+        children = self.children(self.root.index)
+        probs = np.zeros(len(children))
+        probs[np.argmax(self.pool.visits[children])] = 1
+        if DIRICHLET_NOISE:
+            dirichlet = np.random.dirichlet(0.3 * np.ones(len(probs)))
+            idx = np.random.choice(len(children), p=(0.75*probs + 0.25*dirichlet))
+        else:
+            idx = np.random.choice(len(children), p=probs)
+        return self.decode(self.pool.action[children[idx]])
+
+    """
+    returns action - move the threat solver finds without searching (None if THREAT_SOLVER is off)
+    max_nodes, deadline: budget of the threat search, see search_budget.solver_budget
+    """
+    def forced_move(self, max_nodes=None, deadline=None):
+        if not THREAT_SOLVER:
+            return None
+        return self.solver.forced_move(self.root.state, max_nodes, deadline)
+
+    """
+    runs simulations from the root until the budget runs out
+    returns int - number of simulations done
+    """
+    def search(self, simulations=THINK_TIME, deadline=None, early_stop=EARLY_STOP):
+        budget = SearchBudget(simulations, deadline, self.leader_is_safe if early_stop else None)
+        if self.metrics is not None:
+            self.metrics.begin(self)
+        counter = 0
+        while not budget.done(counter):
+            counter += 1
+            index, state = self.tree_policy()
+            if state.terminal:
+                # the player to move at a terminal state has just lost
+                value = 1 if state.curr_player == state.winning_player else -1
+            else:
+                value = self.expand(index, state)
+            self.backup(index, value)
+        if self.metrics is not None:
+            self.metrics.end(self, counter)
+        return counter
+
+    """
+    returns bool - whether the most visited root child stays ahead even if every remaining
+    simulation goes to the runner up
+    """
+    def leader_is_safe(self, remaining):
+        visits = self.pool.visits[self.children(self.root.index)]
+        if len(visits) == 0:
+            return False
+        if len(visits) < 2:
+            return True
+        runner_up, leader = np.partition(visits, -2)[-2:]
+        return leader - runner_up > remaining
+
+    """
+    returns dict - maps: root action -> visits
+    """
+    def root_visits(self):
+        pool = self.pool
+        return dict((self.decode(pool.action[i]), int(pool.visits[i])) for i in self.children(self.root.index))
+
+    """
+    moves the root to the child reached by action, keeping that subtree and its stats
+    the subtree is copied into a fresh pool so the rest of the tree is freed
+    returns nothing
+    """
+    def advance(self, action):
+        state = self.root.state.apply_action(action)
+        children = self.children(self.root.index)
+        match = children[self.pool.action[children] == self.encode(action)]
+        if len(match):
+            self.pool, index = self.pool.compact(int(match[0]))
+        else:
+            self.pool = NodePool(self.pool.capacity)
+            index = self.pool.allocate(1)
+        self.root = PoolNode(self.pool, index, state)
+
+    """
+    descends from the root with puct, computing states along the way
+    returns (int, state) - row and state of an unexpanded or terminal node
+    """
+    def tree_policy(self):
+        pool = self.pool
+        index = self.root.index
+        state = self.root.state
+        while not state.terminal and pool.num_children[index] > 0:
+            index = self.ucb_child(index)
+            state = state.apply_action(self.decode(pool.action[index]))
+        return index, state
+
+    """
+    returns int - row of the puct optimal child of index
+    """
+    def ucb_child(self, index):
+        pool = self.pool
+        first = pool.first_child[index]
+        children = slice(first, first + pool.num_children[index])
+        visits = pool.visits[children]
+        # puct score of every child at once: q + c*prior*sqrt(parent visits)/(1+visits)
+        ucb = -pool.value[children]/np.maximum(visits, 1) + \
+            (self.c*sqrt(pool.visits[index]))*pool.prior[children]/(1+visits)
+        return first + int(np.argmax(ucb))
+
+    """
+    evaluates state and adds a child row for every action with its prior
+    returns float - value of state for its current player
+    """
+    def expand(self, index, state):
+        value, value_action_probs = self.evaluate(state)
+        # same child order as AlphaZeroMCTS edges
+        actions = list(set(state.possible_actions()))
+        count = len(actions)
+        pool = self.pool
+        first = pool.allocate(count)
+        pool.parent[first:first + count] = index
+        pool.action[first:first + count] = [self.encode(action) for action in actions]
+        pool.prior[first:first + count] = [value_action_probs[action] for action in actions]
+        pool.first_child[index] = first
+        pool.num_children[index] = count
+        return value
+
+    """
+    returns (float, action -> float) - nn (value, action probability vector) of state
+    """
+    def evaluate(self, state):
+        from board_encoder import EncodedBoard
+        act_probs, value = self.policy_value_fn(EncodedBoard(state))
+        if THREAT_AT_LEAVES:
+            known = self.solver.leaf_value(state)
+            if known is not None:
+                value = known
+        return value, dict(act_probs)
+
+    def backup(self, index, value):
+        pool = self.pool
+        while index >= 0:
+            pool.visits[index] += 1
+            pool.value[index] += value
+            value = -value
+            index = pool.parent[index]
+
+    def children(self, index):
+        first = self.pool.first_child[index]
+        return np.arange(first, first + self.pool.num_children[index])
+
+    def encode(self, action):
+        return action[0] * self.grid_len + action[1]
+
+    def decode(self, code):
+        return (int(code) // self.grid_len, int(code) % self.grid_len)
+
+    """
+    returns dict - tree_nodes (rows), tree_depth (deepest visited node) and node_bytes of the pool
+    """
+    def tree_stats(self):
+        depth = 0
+        stack = [(self.root.index, 0)]
+        while stack:
+            index, index_depth = stack.pop()
+            depth = max(depth, index_depth)
+            for child in self.children(index):
+                # unvisited rows are edges AlphaZeroMCTS wouldn't have made a node for yet
+                if self.pool.visits[child] > 0:
+                    stack.append((child, index_depth + 1))
+        return {'tree_nodes': len(self.pool), 'tree_depth': depth, 'node_bytes': self.pool.nbytes()}
@@ -0,0 +1,95 @@
+# Multi-core search on top of PureMCTS and AlphaZeroMCTS
+
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from constants import SEARCH_BATCH_SIZE
+from alphazero_mcts import AlphaZeroMCTS
+from pure_mcts import PureMCTS
+
+"""
+root parallelism: every worker process searches its own tree from root_state, seeded with
+seed + worker index, and the visit counts of the root children are summed
+Results only depend on seed and workers, not on scheduling.
+alpha_zero: bool - AlphaZeroMCTS if True else PureMCTS
+simulations: int - simulations per worker (searcher default if None)
+pool: multiprocessing.Pool - reused if given, otherwise one is made for this call
+searcher_kwargs: passed on to the searcher constructor
+returns (action, dict) - (action with the most merged visits, maps: action -> merged visits)
+"""
+def root_parallel_search(root_state, workers, seed, alpha_zero=True, simulations=None, pool=None, **searcher_kwargs):
+    jobs = [(alpha_zero, root_state, seed + i, simulations, searcher_kwargs) for i in range(workers)]
+    if workers == 1:
+        results = map(root_search_worker, jobs)
+    elif pool is not None:
+        results = pool.map(root_search_worker, jobs)
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(root_search_worker, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    merged = merge_root_visits(results)
+    # sorted so ties are broken the same way every time
+    action = max(sorted(merged), key=merged.get)
+    return action, merged
+
+"""
+runs one independent search (in a pool process)
+returns dict - maps: root action -> visits
+"""
+def root_search_worker(job):
+    alpha_zero, root_state, seed, simulations, searcher_kwargs = job
+    np.random.seed(seed)
+    if alpha_zero:
+        searcher = AlphaZeroMCTS(root_state, **searcher_kwargs)
+    else:
+        searcher = PureMCTS(root_state, **searcher_kwargs)
+    if simulations is None:
+        searcher.search()
+    else:
+        searcher.search(simulations)
+    return searcher.root_visits()
+
+"""
+returns dict - maps: action -> sum of its visits over every worker
+"""
+def merge_root_visits(results):
+    merged = {}
+    for root_visits in results:
+        for action, visits in root_visits.items():
+            merged[action] = merged.get(action, 0) + visits
+    return merged
+
+
+"""
+TreeParallelAlphaZeroMCTS --
+AlphaZeroMCTS where workers share one tree: each batch of workers*leaves_per_worker leaves is
+picked with virtual loss, split into one chunk per worker and evaluated concurrently on a thread
+pool (the numpy forward pass releases the GIL), then backed up in selection order.
+Selection and backup stay on the calling thread so results are deterministic.
+- workers: int - evaluation threads
+- close() - stops the thread pool
+"""
+class TreeParallelAlphaZeroMCTS(AlphaZeroMCTS):
+    def __init__(self, root_state, workers, leaves_per_worker=max(1, SEARCH_BATCH_SIZE), **searcher_kwargs):
+        searcher_kwargs['batch_size'] = workers * leaves_per_worker
+        AlphaZeroMCTS.__init__(self, root_state, **searcher_kwargs)
+        self.workers = workers
+        self.pool = ThreadPool(workers)
+
+    def evaluate_boards(self, boards):
+        chunk_len = -(-len(boards) // self.workers)
+        chunks = [boards[i:i+chunk_len] for i in range(0, len(boards), chunk_len)]
+        results = []
+        for chunk_results in self.pool.map(self.policy_value_batch_fn, chunks):
+            results.extend(chunk_results)
+        return results
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,291 @@
+from gomoku_state import GomokuState, grid_len_of
+
+from constants import *
+from zobrist import get_zobrist_keys
+from threat_solver import get_windows, opponent
+
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1)) # row, column, diagonal, anti diagonal
+
+"""
+PatternGomokuState --
+GomokuState carrying a LinePatterns table that apply_action updates for the windows through the
+new stone only, so wins, forced moves and move ordering are lookups instead of walks over the board
+- patterns: LinePatterns - window counts of the position
+- winning_cells(player) -> list - actions completing win_amt in a row for player
+- forced_actions() -> list - the win if the player to move has one, else the cells stopping the
+  opponent's wins (empty when nothing is forced)
+- action_scores() -> dict - maps: action -> pattern score, ordered_actions() -> list - best first
+With PATTERN_PRUNING, options are cut down to forced_actions() whenever there are any, which
+PureMCTS playouts (without FAST_ROLLOUT) and AlphaZeroMCTS expansions both go through.
+Win detection also covers lines with a gap ("gut shots") that get_win_info misses.
+"""
+class PatternGomokuState(GomokuState):
+
+    """
+    patterns: LinePatterns - table of grid, built from scratch when not given
+    win_amt: int - stones in a row to win, win_amt_for(grid_len) if not given (taken from patterns if given)
+    candidates: Candidates - as GomokuState
+    """
+    def __init__(self, grid, curr_player, prev_move, prev_prev_move, board=None, zobrist=None, patterns=None,
+                 win_amt=None, candidates=None):
+        if patterns is None:
+            grid_len = grid_len_of(grid)
+            if win_amt is None:
+                win_amt = win_amt_for(grid_len)
+            patterns = LinePatterns.from_grid(grid, grid_len, win_amt)
+        self.patterns = patterns
+        GomokuState.__init__(self, grid, curr_player, prev_move, prev_prev_move, board, zobrist,
+                             patterns.tables.win_amt, candidates)
+        if PATTERN_PRUNING and not self.terminal:
+            forced = self.forced_actions()
+            if forced:
+                self.options = forced
+
+    """
+    returns PatternGomokuState - new instance of next state after applying action
+    """
+    def apply_action(self, action):
+        ind = action[0] * self.grid_len + action[1]
+        if self.grid[ind] == '.':
+            next_grid = list(self.grid)
+            next_grid[ind] = self.curr_player
+            next_player = opponent(self.curr_player)
+            next_zobrist = self.zobrist ^ get_zobrist_keys(self.grid_len)[self.curr_player][ind]
+            next_patterns = self.patterns.copy()
+            next_patterns.place(next_grid, ind, self.curr_player)
+            next_state = PatternGomokuState(next_grid, next_player, action, self.prev_move, self.board,
+                                            next_zobrist, next_patterns, candidates=self.next_candidates(ind))
+            if self.board:
+                self.board.set_piece(action[0],action[1])
+            return next_state
+        else:
+            print("Bad action")
+            return None
+
+    """
+    returns list - list of reasonable actions, in the same order as GomokuState.get_options
+    """
+    def get_options(self):
+        if self.candidates is not None:
+            return self.candidates.actions()
+        n = self.grid_len
+        if LIMIT_TO_CLOSE_MOVE:
+            if self.patterns.stones == 0:
+                return [((n-1)/2, (n-1)/2)]
+            min_r, max_r, min_c, max_c = self.patterns.box
+            min_r, max_r = max(0, min_r-1), min(n-1, max_r+1)
+            min_c, max_c = max(0, min_c-1), min(n-1, max_c+1)
+            return [(r, c) for r in range(min_r, max_r+1) for c in range(min_c, max_c+1)
+                    if self.grid[r*n + c] == '.']
+        return [(ind // n, ind % n) for ind, piece in enumerate(self.grid) if piece == '.']
+
+    """
+    same contract as GomokuState.get_win_info, but any winning cell of the player to move counts
+    returns (bool, action) - (almost_win, winning action)
+    """
+    def get_win_info(self, prev_prev_move):
+        if prev_prev_move is None:
+            return False, None
+        wins = self.winning_cells(self.grid[prev_prev_move[0]*self.grid_len + prev_prev_move[1]])
+        if wins:
+            return True, wins[0]
+        return False, None
+
+    """
+    checks for win via the pattern table and filled board
+    returns (bool, player) - (terminal, winning_player)
+    """
+    def check_win(self, move):
+        if move is None:
+            return False, None
+        if len(self.options) == 0:
+            #In the unlikely event that no one wins before board is filled
+            #Make white win since black moved first
+            return (True, 'w')
+        player = self.grid[move[0]*self.grid_len + move[1]]
+        if self.patterns.has_won(player):
+            return True, player
+        return False, None
+
+    """
+    returns list - empty cells completing a line for player, sorted
+    """
+    def winning_cells(self, player):
+        n = self.grid_len
+        return [(ind // n, ind % n) for ind in sorted(self.patterns.threats[player])]
+
+    def forced_actions(self):
+        wins = self.winning_cells(self.curr_player)
+        if wins:
+            return wins[:1]
+        return self.winning_cells(opponent(self.curr_player))
+
+    """
+    returns dict - maps: action -> sum of the weights of the open windows through it, for both players
+    """
+    def action_scores(self):
+        scores = self.patterns.scores
+        n = self.grid_len
+        return dict((action, scores[action[0]*n + action[1]]) for action in self.options)
+
+    """
+    returns list - options, highest pattern score first (ties in options order)
+    """
+    def ordered_actions(self):
+        scores = self.patterns.scores
+        n = self.grid_len
+        return sorted(self.options, key=lambda action: -scores[action[0]*n + action[1]])
+
+
+"""
+LinePatterns --
+per window stone counts of a position and tallies derived from them, updated stone by stone
+- counts: dict - maps: player -> stones of player in every window (see threat_solver.get_windows)
+- lines: dict - maps: player -> lines[direction][stones], the number of windows along direction
+  (index into DIRECTIONS) holding stones of player and none of the opponent, so lines['b'][0][3]
+  counts black's open threes along rows; lines[player][d][win_amt] > 0 means player has won
+- threats: dict - maps: player -> {empty cell index: windows it would complete for player}
+- scores: list - per cell sum of window_weight over the open windows through it (both players)
+- stones: int - stones on the board, box: (min_r, max_r, min_c, max_c) - their bounding box
+"""
+class LinePatterns(object):
+    __slots__ = ('tables', 'counts', 'lines', 'threats', 'scores', 'stones', 'box')
+
+    def __init__(self, tables):
+        self.tables = tables
+        num_windows = len(tables.windows)
+        self.counts = {'b': [0] * num_windows, 'w': [0] * num_windows}
+        self.lines = dict((player, [[0] * (tables.win_amt + 1) for _ in DIRECTIONS]) for player in 'bw')
+        self.threats = {'b': {}, 'w': {}}
+        self.scores = [0] * (tables.grid_len * tables.grid_len)
+        self.stones = 0
+        self.box = None
+
+    """
+    returns LinePatterns - table of grid, built by placing its stones one at a time
+    """
+    @classmethod
+    def from_grid(cls, grid, grid_len, win_amt):
+        patterns = cls(get_pattern_tables(grid_len, win_amt))
+        cells = ['.'] * len(grid)
+        for ind, piece in enumerate(grid):
+            if piece != '.':
+                cells[ind] = piece
+                patterns.place(cells, ind, piece)
+        return patterns
+
+    def copy(self):
+        patterns = LinePatterns.__new__(LinePatterns)
+        patterns.tables = self.tables
+        patterns.counts = {'b': self.counts['b'][:], 'w': self.counts['w'][:]}
+        patterns.lines = dict((player, [row[:] for row in rows]) for player, rows in self.lines.items())
+        patterns.threats = {'b': dict(self.threats['b']), 'w': dict(self.threats['w'])}
+        patterns.scores = self.scores[:]
+        patterns.stones = self.stones
+        patterns.box = self.box
+        return patterns
+
+    """
+    updates the table for player's stone at ind
+    cells: list - the grid with the stone already placed
+    returns nothing
+    """
+    def place(self, cells, ind, player):
+        tables = self.tables
+        windows = tables.windows
+        weights = tables.weights
+        almost = tables.win_amt - 1
+        other = opponent(player)
+        own_counts, other_counts = self.counts[player], self.counts[other]
+        own_lines, other_lines = self.lines[player], self.lines[other]
+        own_threats, other_threats = self.threats[player], self.threats[other]
+        scores = self.scores
+        for w in tables.cell_windows[ind]:
+            own, opp = own_counts[w], other_counts[w]
+            own_counts[w] = own + 1
+            if opp > 0:
+                if own == 0:
+                    # the window was open for the opponent and is dead now
+                    other_lines[tables.directions[w]][opp] -= 1
+                    if opp == almost:
+                        remove_threat(other_threats, ind)
+                    change = -weights[opp]
+                else:
+                    continue
+            else:
+                row = own_lines[tables.directions[w]]
+                if own > 0:
+                    row[own] -= 1
+                row[own + 1] += 1
+                if own == almost:
+                    remove_threat(own_threats, ind)
+                elif own + 1 == almost:
+                    for cell in windows[w]:
+                        if cells[cell] == '.':
+                            own_threats[cell] = own_threats.get(cell, 0) + 1
+                change = weights[own + 1] - weights[own]
+            for cell in windows[w]:
+                scores[cell] += change
+
+        r, c = divmod(ind, tables.grid_len)
+        if self.box is None:
+            self.box = (r, r, c, c)
+        else:
+            min_r, max_r, min_c, max_c = self.box
+            self.box = (min(min_r, r), max(max_r, r), min(min_c, c), max(max_c, c))
+        self.stones += 1
+
+    def has_won(self, player):
+        win_amt = self.tables.win_amt
+        for row in self.lines[player]:
+            if row[win_amt]:
+                return True
+        return False
+
+    """
+    returns int - open windows of player with exactly stones of its stones, along direction or all four
+    """
+    def count(self, player, stones, direction=None):
+        if direction is not None:
+            return self.lines[player][direction][stones]
+        return sum(row[stones] for row in self.lines[player])
+
+
+def remove_threat(threats, ind):
+    if threats[ind] == 1:
+        del threats[ind]
+    else:
+        threats[ind] -= 1
+
+
+"""
+PatternTables --
+window layout shared by every LinePatterns of a board geometry
+- windows, cell_windows: see threat_solver.get_windows
+- directions: list - index into DIRECTIONS of every window
+- weights: list - window_weight by stone count
+"""
+class PatternTables(object):
+    def __init__(self, grid_len, win_amt):
+        self.grid_len = grid_len
+        self.win_amt = win_amt
+        self.windows, self.cell_windows = get_windows(grid_len, win_amt)
+        steps = [dr*grid_len + dc for dr, dc in DIRECTIONS]
+        self.directions = [steps.index(window[1] - window[0]) for window in self.windows]
+        self.weights = [window_weight(stones) for stones in range(win_amt + 1)]
+
+
+"""
+returns int - move ordering weight of an open window with stones of one player in it
+"""
+def window_weight(stones):
+    return 0 if stones == 0 else 4 ** stones
+
+
+_tables = {}
+
+def get_pattern_tables(grid_len, win_amt):
+    key = (grid_len, win_amt)
+    if key not in _tables:
+        _tables[key] = PatternTables(grid_len, win_amt)
+    return _tables[key]
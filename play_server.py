@@ -0,0 +1,421 @@
+# Headless multi-game server speaking line delimited JSON over a local TCP socket, e.g.
+#   python play_server.py --port 7777 --workers 4
+#
+# Every request is one JSON object on one line, every response one line back:
+#   {"id": 1, "op": "new", "agent": "az:sims=400", "size": 8} -> {"id": 1, "ok": true, "session": "1", "state": {...}}
+#   {"id": 2, "op": "move", "session": "1", "move": [3, 4]} -> {"id": 2, "ok": true, "state": {...}}
+#   {"id": 3, "op": "think", "session": "1", "time": 1.0}   -> {"id": 3, "ok": true, "move": [4, 4], ...}
+#   {"id": 4, "op": "close", "session": "1"}
+# Failures come back as {"id": ..., "ok": false, "error": "..."}.
+from __future__ import print_function
+import argparse
+import itertools
+import json
+import socket
+import SocketServer
+import threading
+import time
+from collections import deque
+
+from constants import SERVER_PORT, SERVER_WORKERS, SERVER_SLICE, SERVER_MAX_SECONDS, SERVER_MAX_SESSIONS, \
+    EARLY_STOP, GRID_LEN, MIN_GRID_LEN, MAX_GRID_LEN
+from arena import parse_agent, check_budget, make_searcher, empty_state
+from model_registry import resolve_model_path
+from search_budget import solver_budget
+
+
+class ServerError(Exception):
+    pass
+
+
+"""
+Session --
+one game hosted by the server
+- id: str
+- spec: dict - agent spec (see arena.parse_agent) of the searcher playing for the server
+- state: state - current position
+- searcher: object - search tree kept between moves (None until the first think, or when reuse is off)
+- busy: bool - a think is running, the session takes no other moves meanwhile
+"""
+class Session(object):
+    def __init__(self, session_id, spec, grid_len=GRID_LEN):
+        self.id = session_id
+        self.spec = spec
+        self.state = empty_state(grid_len)
+        self.searcher = None
+        self.moves = []
+        self.busy = False
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+    """
+    plays action for the player to move and follows it in the search tree
+    returns nothing
+    """
+    def play(self, action):
+        if self.state.terminal:
+            raise ServerError("Game is over")
+        if action not in self.state.possible_actions():
+            raise ServerError("Illegal move: {}".format(list(action)))
+        self.state = self.state.apply_action(action)
+        self.moves.append(action)
+        if self.searcher is not None:
+            if self.spec['reuse']:
+                self.searcher.advance(action)
+            else:
+                self.searcher = None
+
+    """
+    returns dict - json friendly view of the position
+    """
+    def describe(self):
+        state = self.state
+        n = state.grid_len
+        grid = state.grid
+        return {
+            'grid': [''.join(grid[r*n:(r+1)*n]) for r in range(n)],
+            'to_move': state.curr_player,
+            'last_move': list(self.moves[-1]) if self.moves else None,
+            'moves': len(self.moves),
+            'terminal': state.terminal,
+            'winner': state.winning_player,
+        }
+
+
+"""
+ThinkJob --
+search for one think request, run by the Scheduler a slice at a time
+- simulations: int - node budget (None for none), deadline: float - time.time() to stop at
+- forced: action - move found by the threat search of the first step (None if it needs searching)
+- searched: int - simulations done so far
+- done: threading.Event - set once finished (or failed, then error is set)
+"""
+class ThinkJob(object):
+    def __init__(self, session, simulations, deadline):
+        self.session = session
+        self.simulations = simulations
+        self.deadline = deadline
+        self.checked = False
+        self.forced = None
+        self.searched = 0
+        self.error = None
+        self.done = threading.Event()
+
+    """
+    the first step looks for a forced move (its budget taken from the job's), later ones run at
+    most slice_simulations simulations
+    returns bool - whether the job is finished
+    """
+    def step(self, slice_simulations):
+        searcher = self.session.searcher
+        if not self.checked:
+            self.checked = True
+            self.forced = searcher.forced_move(*solver_budget(self.simulations, self.deadline - time.time()))
+            return self.forced is not None
+        if self.simulations is not None:
+            slice_simulations = min(slice_simulations, self.simulations - self.searched)
+        self.searched += searcher.search(slice_simulations, self.deadline, early_stop=False)
+        if self.searched == 0:
+            return False
+        if self.simulations is not None:
+            remaining = self.simulations - self.searched
+            if remaining <= 0 or (EARLY_STOP and searcher.leader_is_safe(remaining)):
+                return True
+        return self.deadline is not None and time.time() >= self.deadline
+
+
+"""
+Scheduler --
+worker threads running ThinkJobs round robin, one slice per turn, so a long think shares the
+workers with every other game instead of holding one until it's done
+- workers: int - threads searching at once
+- slice_simulations: int - simulations per turn
+"""
+class Scheduler(object):
+    def __init__(self, workers=SERVER_WORKERS, slice_simulations=SERVER_SLICE):
+        self.slice_simulations = slice_simulations
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.threads = [threading.Thread(target=self.run, name="Scheduler-{}".format(i)) for i in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, job):
+        with self.condition:
+            if self.closed:
+                raise ServerError("Server is shutting down")
+            self.queue.append(job)
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                job = self.queue.popleft()
+            try:
+                finished = job.step(self.slice_simulations)
+            except Exception as e:
+                job.error = e
+                finished = True
+            if finished:
+                job.done.set()
+            else:
+                # back of the line behind every other waiting job
+                self.submit(job)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            jobs = list(self.queue)
+            self.queue.clear()
+            self.condition.notify_all()
+        for job in jobs:
+            job.error = ServerError("Server is shutting down")
+            job.done.set()
+        for thread in self.threads:
+            thread.join()
+
+
+"""
+GameServer --
+sessions and request handling, independent of the transport
+- handle(request) -> dict - response to one decoded request
+- max_seconds: float - cap on the time budget of a think (and the default when a request gives none)
+"""
+class GameServer(object):
+    def __init__(self, workers=SERVER_WORKERS, slice_simulations=SERVER_SLICE, max_seconds=SERVER_MAX_SECONDS,
+                 max_sessions=SERVER_MAX_SESSIONS):
+        self.scheduler = Scheduler(workers, slice_simulations)
+        self.max_seconds = max_seconds
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.ops = {
+            'new': self.op_new,
+            'move': self.op_move,
+            'think': self.op_think,
+            'state': self.op_state,
+            'close': self.op_close,
+            'sessions': self.op_sessions,
+        }
+
+    def handle(self, request):
+        response = {'id': request.get('id') if isinstance(request, dict) else None}
+        try:
+            if not isinstance(request, dict) or request.get('op') not in self.ops:
+                raise ServerError("Unknown op")
+            response.update(self.ops[request['op']](request))
+            response['ok'] = True
+        except Exception as e:
+            response['ok'] = False
+            response['error'] = str(e) or e.__class__.__name__
+        return response
+
+    """
+    agent: str - agent spec for the server's side, e.g. "az:sims=400" or "pure:time=0.5"
+    size: int - board size (GRID_LEN if not given), az agents need a model for it
+    """
+    def op_new(self, request):
+        spec = parse_agent(request.get('agent', 'az'))
+        grid_len = request.get('size', GRID_LEN)
+        if not isinstance(grid_len, int) or not MIN_GRID_LEN <= grid_len <= MAX_GRID_LEN:
+            raise ServerError("Size must be from {} to {}".format(MIN_GRID_LEN, MAX_GRID_LEN))
+        if spec['kind'] == 'az':
+            resolve_model_path(grid_len, spec['searcher_kwargs'].get('model_file'))
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                raise ServerError("Too many sessions")
+            session = Session(str(next(self.ids)), spec, grid_len)
+            self.sessions[session.id] = session
+        return {'session': session.id, 'state': session.describe()}
+
+    """
+    move: [r, c] - move for the player to move
+    """
+    def op_move(self, request):
+        session = self.session(request)
+        action = parse_move(request.get('move'))
+        with session.lock:
+            if session.busy:
+                raise ServerError("Session is thinking")
+            session.play(action)
+        return {'state': session.describe()}
+
+    """
+    picks a move for the player to move within the request's budget
+    time: float - seconds (capped at max_seconds), sims: int - simulations, both default to the agent spec
+    play: bool - also play the move (default true)
+    """
+    def op_think(self, request):
+        session = self.session(request)
+        spec = session.spec
+        seconds = request.get('time', spec['time'])
+        seconds = None if seconds is None else float(seconds)
+        simulations = request.get('sims', spec['sims'] if 'time' not in request else None)
+        simulations = None if simulations is None else int(simulations)
+        check_budget(simulations, seconds)
+        seconds = self.max_seconds if seconds is None else min(seconds, self.max_seconds)
+        start = time.time()
+        with session.lock:
+            if session.busy:
+                raise ServerError("Session is thinking")
+            if session.state.terminal:
+                raise ServerError("Game is over")
+            session.busy = True
+        try:
+            if session.searcher is None:
+                session.searcher = make_searcher(spec, session.state)
+            job = ThinkJob(session, simulations, start + seconds)
+            self.scheduler.submit(job)
+            job.done.wait()
+            if job.error is not None:
+                raise job.error
+            action = job.forced or session.searcher.choose_action()
+            with session.lock:
+                if request.get('play', True):
+                    session.play(action)
+        finally:
+            with session.lock:
+                session.busy = False
+        return {'move': list(action), 'forced': job.forced is not None, 'simulations': job.searched,
+                'seconds': time.time() - start, 'state': session.describe()}
+
+    def op_state(self, request):
+        session = self.session(request)
+        return {'state': session.describe(), 'agent': session.spec['name']}
+
+    def op_close(self, request):
+        with self.lock:
+            session = self.sessions.pop(str(request.get('session')), None)
+        if session is None:
+            raise ServerError("Unknown session")
+        return {}
+
+    def op_sessions(self, request):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return {'sessions': [{'session': s.id, 'agent': s.spec['name'], 'size': s.state.grid_len, 'moves': len(s.moves),
+                              'busy': s.busy, 'terminal': s.state.terminal} for s in sessions]}
+
+    def session(self, request):
+        with self.lock:
+            session = self.sessions.get(str(request.get('session')))
+        if session is None:
+            raise ServerError("Unknown session")
+        session.last_used = time.time()
+        return session
+
+    def close(self):
+        self.scheduler.close()
+
+
+"""
+returns action - (r, c) from a json [r, c]
+"""
+def parse_move(move):
+    if not isinstance(move, list) or len(move) != 2 or not all(isinstance(x, int) for x in move):
+        raise ServerError("Move must be [row, column]")
+    return tuple(move)
+
+
+"""
+RequestHandler --
+one connection: a request per line in, a response per line out
+"""
+class RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'id': None, 'ok': False, 'error': "Bad json"}
+            else:
+                response = self.server.game_server.handle(request)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+"""
+SocketGameServer --
+GameServer behind a threaded TCP server (a thread per connection, searching happens in the Scheduler)
+"""
+class SocketGameServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, game_server):
+        SocketServer.TCPServer.__init__(self, address, RequestHandler)
+        self.game_server = game_server
+
+
+"""
+LocalClient --
+client stand-in calling a GameServer directly, with requests and responses passed through json
+like on the wire
+- request(op, **fields) -> dict - response, raises ServerError if it isn't ok
+"""
+class LocalClient(object):
+    def __init__(self, game_server):
+        self.game_server = game_server
+        self.ids = itertools.count(1)
+
+    def request(self, op, **fields):
+        fields.update({'op': op, 'id': next(self.ids)})
+        response = json.loads(json.dumps(self.game_server.handle(json.loads(json.dumps(fields)))))
+        return check(response)
+
+
+"""
+SocketClient --
+LocalClient's interface over a connection to a SocketGameServer
+"""
+class SocketClient(object):
+    def __init__(self, host='localhost', port=SERVER_PORT):
+        self.sock = socket.create_connection((host, port))
+        self.rfile = self.sock.makefile('rb')
+        self.ids = itertools.count(1)
+
+    def request(self, op, **fields):
+        fields.update({'op': op, 'id': next(self.ids)})
+        self.sock.sendall(json.dumps(fields) + '\n')
+        return check(json.loads(self.rfile.readline()))
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def check(response):
+    if not response.get('ok'):
+        raise ServerError(response.get('error'))
+    return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve gomoku games over line delimited JSON.")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help="threads searching at once")
+    parser.add_argument('--slice', type=int, default=SERVER_SLICE, help="simulations per scheduling turn")
+    parser.add_argument('--max-seconds', type=float, default=SERVER_MAX_SECONDS, help="cap on think time")
+    args = parser.parse_args()
+
+    game_server = GameServer(args.workers, args.slice, args.max_seconds)
+    server = SocketGameServer((args.host, args.port), game_server)
+    print("Serving on {}:{}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        game_server.close()
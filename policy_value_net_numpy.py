@@ -5,13 +5,19 @@ trained AI model without installing any DL framwork
 """
 
 from __future__ import print_function
+import threading
+
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from board_encoder import encode_batch
 
 
 # some utility functions
 def softmax(x):
-    probs = np.exp(x - np.max(x))
-    probs /= np.sum(probs)
+    # row-wise, so a whole batch of logits can be normalized at once
+    probs = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    probs /= np.sum(probs, axis=-1, keepdims=True)
     return probs
 
 
@@ -20,11 +26,12 @@ def relu(X):
     return out
 
 
-def conv_forward(X, W, b, stride=1, padding=1):
+def conv_forward(X, W, b, stride=1, padding=1, flip=True):
     n_filters, d_filter, h_filter, w_filter = W.shape
     # theano conv2d flips the filters (rotate 180 degree) first
-    # while doing the calculation
-    W = W[:, :, ::-1, ::-1]
+    # while doing the calculation (skipped when W was flipped ahead of time)
+    if flip:
+        W = W[:, :, ::-1, ::-1]
     n_x, d_x, h_x, w_x = X.shape
     h_out = (h_x - h_filter + 2 * padding) / stride + 1
     w_out = (w_x - w_filter + 2 * padding) / stride + 1
@@ -82,34 +89,220 @@ def im2col_indices(x, field_height, field_width, padding=1, stride=1):
 
 class PolicyValueNetNumpy():
     """policy-value network in numpy """
-    def __init__(self, board_width, board_height, net_params):
+    def __init__(self, board_width, board_height, net_params,
+                 flipped_filters=False, engine=None):
         self.board_width = board_width
         self.board_height = board_height
         self.params = net_params
+        # True if the conv filters in net_params are already rotated 180 degree
+        self.flip = not flipped_filters
+        # optional ForwardEngine used instead of the reference forward pass
+        self.engine = engine
 
-    def policy_value_fn(self, board):
+    def policy_value(self, state_batch):
         """
-        input: board
-        output: a list of (action, probability) tuples for each available
-        action and the score of the board state
+        input: a batch of states, shape (N, 4, width, height)
+        output: a batch of action probabilities, shape (N, width*height),
+        and state values, shape (N,)
         """
-        legal_positions = board.availables
-        current_state = board.current_state()
+        if self.engine is not None:
+            return self.engine.policy_value(state_batch)
+        return self.reference_policy_value(state_batch)
 
-        X = current_state.reshape(-1, 4, self.board_width, self.board_height)
+    def reference_policy_value(self, state_batch):
+        """
+        the plain im2col forward pass, kept to check ForwardEngine against
+        """
+        X = np.asarray(state_batch).reshape(-1, 4, self.board_width,
+                                            self.board_height)
+        X = X.astype(self.params[0].dtype, copy=False)
+        n_x = X.shape[0]
         # first 3 conv layers with ReLu nonlinearity
         for i in [0, 2, 4]:
-            X = relu(conv_forward(X, self.params[i], self.params[i+1]))
+            X = relu(conv_forward(X, self.params[i], self.params[i+1],
+                                  flip=self.flip))
         # policy head
-        X_p = relu(conv_forward(X, self.params[6], self.params[7], padding=0))
-        X_p = fc_forward(X_p.flatten(), self.params[8], self.params[9])
+        X_p = relu(conv_forward(X, self.params[6], self.params[7], padding=0,
+                                flip=self.flip))
+        X_p = fc_forward(X_p.reshape(n_x, -1), self.params[8], self.params[9])
         act_probs = softmax(X_p)
         # value head
         X_v = relu(conv_forward(X, self.params[10],
-                                self.params[11], padding=0))
-        X_v = relu(fc_forward(X_v.flatten(), self.params[12], self.params[13]))
-        value = np.tanh(fc_forward(X_v, self.params[14], self.params[15]))[0]
-        from gomoku_state import bad_move_to_good_move, ind_to_move
-        good_legal_pos = map(bad_move_to_good_move, legal_positions)
-        act_probs = zip(map(ind_to_move, good_legal_pos), act_probs.flatten()[legal_positions])
-        return act_probs, value
\ No newline at end of file
+                                self.params[11], padding=0, flip=self.flip))
+        X_v = relu(fc_forward(X_v.reshape(n_x, -1), self.params[12],
+                              self.params[13]))
+        values = np.tanh(fc_forward(X_v, self.params[14], self.params[15]))
+        return act_probs, values[:, 0]
+
+    def policy_value_fn(self, board):
+        """
+        input: board
+        output: a list of (action, probability) tuples for each available
+        action and the score of the board state
+        """
+        act_probs, values = self.policy_value(encode_batch([board]))
+        return self.legal_act_probs(board, act_probs[0]), values[0]
+
+    def policy_value_batch_fn(self, boards):
+        """
+        input: a list of boards
+        output: a list of (act_probs, value) pairs in the same format as
+        policy_value_fn, computed with a single forward pass
+        """
+        act_probs, values = self.policy_value(encode_batch(boards))
+        return [(self.legal_act_probs(board, act_probs[i]), values[i])
+                for i, board in enumerate(boards)]
+
+    def legal_act_probs(self, board, act_probs):
+        """
+        output: a list of (action, probability) tuples for each legal
+        action of the board (EncodedBoard: empty cells, NNBoardState: every
+        cell), with actions mapped back to (row, col) grid moves
+        """
+        return board.act_probs(act_probs)
+
+
+class ConvLayer(object):
+    """
+    one conv layer of a ForwardEngine with its gather indices built once
+    activations are laid out (channels, height, width, batch) so the output
+    of np.dot is already the next layer's input and no transposes are needed
+    """
+    def __init__(self, W, b, height, width, padding, mode='gather'):
+        n_filters, channels, h_filter, w_filter = W.shape
+        self.channels = channels
+        self.height, self.width = height, width
+        self.padding = padding
+        self.n_filters = n_filters
+        self.field = (h_filter, w_filter)
+        self.mode = mode
+        self.W = np.ascontiguousarray(W, dtype=np.float32)
+        self.W_col = self.W.reshape(n_filters, -1)
+        self.b = np.asarray(b, dtype=np.float32).reshape(-1, 1)
+        self.h_out = height - h_filter + 2 * padding + 1
+        self.w_out = width - w_filter + 2 * padding + 1
+        self.h_pad, self.w_pad = height + 2 * padding, width + 2 * padding
+        # row of every column entry in the flattened (C*Hp*Wp, N) padded input
+        k, i, j = get_im2col_indices((1, channels, height, width), h_filter,
+                                     w_filter, padding=padding, stride=1)
+        self.gather = ((k * self.h_pad + i) * self.w_pad + j).ravel()
+        self.pointwise = h_filter == 1 and w_filter == 1 and padding == 0
+
+    def forward(self, X, buffers):
+        """
+        input: activations, shape (C, H, W, N)
+        buffers: dict reused between calls with the same batch size
+        output: relu of the conv, shape (F, H_out, W_out, N)
+        """
+        n_x = X.shape[-1]
+        if self.pointwise:
+            out = np.dot(self.W_col, X.reshape(self.channels, -1))
+        else:
+            p = self.padding
+            padded = buffers.get('padded')
+            if padded is None:
+                # the border is written once and stays zero
+                padded = np.zeros((self.channels, self.h_pad, self.w_pad, n_x),
+                                  dtype=np.float32)
+                buffers['padded'] = padded
+            padded[:, p:p + self.height, p:p + self.width, :] = X
+            if self.mode == 'einsum':
+                out = self.einsum_conv(padded)
+            else:
+                cols = buffers.get('cols')
+                if cols is None:
+                    cols = np.empty((len(self.gather), n_x), dtype=np.float32)
+                    buffers['cols'] = cols
+                np.take(padded.reshape(-1, n_x), self.gather, axis=0, out=cols)
+                out = np.dot(self.W_col, cols.reshape(self.W_col.shape[1], -1))
+        out = out.reshape(self.n_filters, -1)
+        out += self.b
+        np.maximum(out, 0, out=out)
+        return out.reshape(self.n_filters, self.h_out, self.w_out, n_x)
+
+    def einsum_conv(self, padded):
+        """
+        convolution over a strided window view of the padded input, no
+        column matrix is materialized
+        """
+        h_filter, w_filter = self.field
+        s_c, s_h, s_w, s_n = padded.strides
+        windows = as_strided(padded,
+                             shape=(self.channels, h_filter, w_filter,
+                                    self.h_out, self.w_out, padded.shape[-1]),
+                             strides=(s_c, s_h, s_w, s_h, s_w, s_n))
+        return np.einsum('fcij,cijhwn->fhwn', self.W, windows, optimize=True)
+
+
+class ForwardEngine(object):
+    """
+    faster forward pass for PolicyValueNetNumpy
+    gather indices are computed once per layer, padded input and column
+    buffers are kept per thread and reused while the batch size stays the
+    same, and everything runs in float32
+    mode: 'gather' (im2col through np.take + np.dot) or 'einsum'
+    (stride tricks window view + np.einsum)
+    """
+    def __init__(self, board_width, board_height, net_params,
+                 flipped_filters=False, mode='gather'):
+        if mode not in ('gather', 'einsum'):
+            raise ValueError("Unknown conv mode: {}".format(mode))
+        self.board_width = board_width
+        self.board_height = board_height
+        params = [np.asarray(param, dtype=np.float32) for param in net_params]
+        if not flipped_filters:
+            # theano conv2d flips the filters, do it once here
+            for i in (0, 2, 4, 6, 10):
+                params[i] = params[i][:, :, ::-1, ::-1]
+        self.trunk = [ConvLayer(params[i], params[i + 1], board_width,
+                                board_height, 1, mode) for i in (0, 2, 4)]
+        self.policy_conv = ConvLayer(params[6], params[7], board_width,
+                                     board_height, 0, mode)
+        self.value_conv = ConvLayer(params[10], params[11], board_width,
+                                    board_height, 0, mode)
+        self.policy_fc = (params[8], params[9])
+        self.value_fc = (params[12], params[13], params[14], params[15])
+        self.local = threading.local()
+
+    def layer_buffers(self, n_x):
+        buffers = getattr(self.local, 'buffers', None)
+        if buffers is None or self.local.batch_size != n_x:
+            buffers = [{} for _ in self.trunk]
+            self.local.buffers = buffers
+            self.local.batch_size = n_x
+        return buffers
+
+    def policy_value(self, state_batch):
+        """
+        same inputs and outputs as PolicyValueNetNumpy.policy_value
+        """
+        X = np.asarray(state_batch, dtype=np.float32).reshape(
+            -1, 4, self.board_width, self.board_height)
+        n_x = X.shape[0]
+        X = X.transpose(1, 2, 3, 0)
+        for layer, buffers in zip(self.trunk, self.layer_buffers(n_x)):
+            X = layer.forward(X, buffers)
+        # policy head, fc layers take (N, C*H*W) rows
+        X_p = self.policy_conv.forward(X, None)
+        X_p = X_p.transpose(3, 0, 1, 2).reshape(n_x, -1)
+        act_probs = softmax(fc_forward(X_p, *self.policy_fc))
+        # value head
+        X_v = self.value_conv.forward(X, None)
+        X_v = X_v.transpose(3, 0, 1, 2).reshape(n_x, -1)
+        W1, b1, W2, b2 = self.value_fc
+        X_v = relu(fc_forward(X_v, W1, b1))
+        values = np.tanh(fc_forward(X_v, W2, b2))
+        return act_probs, values[:, 0]
+
+    def max_error(self, net, n_x=16, seed=0):
+        """
+        output: largest absolute difference between this engine and the
+        reference forward pass of net on a random batch of boards
+        """
+        rng = np.random.RandomState(seed)
+        state_batch = rng.randint(0, 2, (n_x, 4, self.board_width,
+                                         self.board_height))
+        probs, values = self.policy_value(state_batch)
+        ref_probs, ref_values = net.reference_policy_value(state_batch)
+        return max(np.abs(probs - ref_probs).max(),
+                   np.abs(values - ref_values).max())
@@ -0,0 +1,45 @@
+# Searching on the opponent's time
+
+import threading
+import time
+
+from constants import PONDER_SLICE, PONDER_LIMIT
+
+"""
+Ponderer --
+keeps a searcher's tree growing in a background thread while the opponent thinks
+The searcher must not be touched by anything else until stop() returns; the caller then
+advances it along the opponent's move and the visits banked under that move are reused.
+- searcher: PureMCTS or AlphaZeroMCTS
+- slice_simulations: int - simulations per search call, the stop flag is checked between calls
+- max_simulations: int - stop pondering after this many simulations (None for no limit)
+- start() - starts the background thread
+- stop() -> int - stops it and returns the number of simulations done
+"""
+class Ponderer:
+    def __init__(self, searcher, slice_simulations=PONDER_SLICE, max_simulations=PONDER_LIMIT):
+        self.searcher = searcher
+        self.slice_simulations = slice_simulations
+        self.max_simulations = max_simulations
+        self.simulations = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if self.searcher.root.terminal:
+                break
+            if self.max_simulations is not None and self.simulations >= self.max_simulations:
+                break
+            self.simulations += self.searcher.search(self.slice_simulations, early_stop=False)
+            # give the ui thread the interpreter between slices
+            time.sleep(0.001)
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        return self.simulations
@@ -3,6 +3,13 @@
 import numpy as np
 from math import sqrt, log
 
+from constants import TRANSPOSITION_TABLE, TT_SIZE, TT_REPLACEMENT, PRINT_SEARCH_LEADER, FAST_ROLLOUT, \
+    THINK_SECONDS, EARLY_STOP, THREAT_SOLVER
+from rollout import RolloutEngine
+from search_budget import SearchBudget, deadline_after, solver_budget
+from transposition import TranspositionTable
+from threat_solver import ThreatSolver
+
 THINK_TIME = 2000
 
 """
@@ -10,36 +17,128 @@ PureMCTS --
 main mcts class
 - root: Node - init with root state
 - uct_search: action - best action from mcts
+- search(simulations): runs simulations without choosing a move
+- choose_action() -> action - move to play after search, without printing
+- root_visits() -> dict - maps: root action -> visits
+- advance(action): moves the root along a played action, reusing its subtree
 """
 class PureMCTS:
-    def __init__(self, root_state):
-        self.root = Node(root_state)
+    metrics = None # metrics.SearchMetrics, set by its attach()
+
+    """
+    transposition_table: TranspositionTable - shares stats between nodes of the same position,
+    a new one is made if None and TRANSPOSITION_TABLE is set
+    fast_rollout: bool - play simulations with a RolloutEngine (uniform over every empty cell)
+    instead of stepping through states (which follow possible_actions)
+    """
+    def __init__(self, root_state, transposition_table=None, fast_rollout=FAST_ROLLOUT):
+        if transposition_table is None and TRANSPOSITION_TABLE:
+            transposition_table = TranspositionTable(TT_SIZE, TT_REPLACEMENT)
+        self.transposition_table = transposition_table
+        self.root = self.make_node(root_state)
+        self.rollout_engine = RolloutEngine(root_state.grid_len, root_state.win_amt) if fast_rollout else None
+        self.solver = ThreatSolver(root_state.grid_len, root_state.win_amt)
 
     """
-    main algo loop
+    main algo loop, stops at whichever of the node and time budgets runs out first
+    simulations: int - node budget (None for no limit)
+    time_budget: float - seconds to search for (None for no limit)
     returns action - best action
     """
-    def uct_search(self):
+    def uct_search(self, simulations=THINK_TIME, time_budget=THINK_SECONDS):
+        # the threat search's time comes out of the move's time budget
+        deadline = deadline_after(time_budget)
+        action = self.forced_move(*solver_budget(simulations, time_budget))
+        if action is not None:
+            print("Forced move: {}".format(action))
+            return action
+
+        self.search(simulations, deadline)
+
+        # print child stats
+        children = self.root.action_children.values()
+        children = sorted(children, key= lambda c: c.q_val(), reverse=True)
+        for child in children:
+            print("Action: {}, Wins: {}, Visits: {} WR: {}".format(child.state.prev_move, child.losses, child.visits, float(child.losses)/child.visits))
+
+        return self.choose_action()
+
+    """
+    returns action - root action with the highest win rate (no searching or printing)
+    """
+    def choose_action(self):
+        action, child = self.wr_action_child(self.root)
+        return action
+
+    """
+    returns action - move the threat solver finds without searching (None if THREAT_SOLVER is off)
+    max_nodes, deadline: budget of the threat search, see search_budget.solver_budget
+    """
+    def forced_move(self, max_nodes=None, deadline=None):
+        if not THREAT_SOLVER:
+            return None
+        return self.solver.forced_move(self.root.state, max_nodes, deadline)
+
+    """
+    runs simulations from the root until the budget runs out
+    simulations: int - node budget (None for no limit)
+    deadline: float - time.time() to stop at (None for no limit)
+    early_stop: bool - also stop once the best root child can't be overtaken
+    returns int - number of simulations done
+    """
+    def search(self, simulations=THINK_TIME, deadline=None, early_stop=EARLY_STOP):
+        budget = SearchBudget(simulations, deadline, self.leader_is_safe if early_stop else None)
+        if self.metrics is not None:
+            self.metrics.begin(self)
         counter = 0
-        while counter < THINK_TIME:
+        while not budget.done(counter):
             counter += 1
             node_to_sim = self.tree_policy(self.root)
             winning_player = self.default_policy(node_to_sim)
             self.backup(node_to_sim, winning_player)
 
             # print child stats
-            if counter % 100 == 0:
+            if PRINT_SEARCH_LEADER and counter % 100 == 0:
                 action, child = self.wr_action_child(self.root)
                 print("best ac so far:({}, {})".format(action[0], action[1]))
+        if self.metrics is not None:
+            self.metrics.end(self, counter)
+        return counter
 
-        # print child stats
+    """
+    remaining: float - simulations (at most) left in the budget
+    returns bool - whether the win rate leader (the move choose_action plays) keeps the best win rate
+    even if it loses every remaining simulation and any other child wins all of them
+    """
+    def leader_is_safe(self, remaining):
+        if not self.root.fully_expanded() or remaining == float('inf'):
+            return False
         children = self.root.action_children.values()
-        children = sorted(children, key= lambda c: c.q_val(), reverse=True)
-        for child in children:
-            print("Action: {}, Wins: {}, Visits: {} WR: {}".format(child.state.prev_move, child.losses, child.visits, float(child.losses)/child.visits))
+        if len(children) < 2:
+            return True
+        leader = self.wr_action_child(self.root)[1]
+        worst = float(leader.losses) / (leader.visits + remaining)
+        return all(float(child.losses + remaining) / (child.visits + remaining) < worst
+                   for child in children if child is not leader)
 
-        action, child = self.wr_action_child(self.root)
-        return action
+    """
+    returns dict - maps: root action -> visits of its child
+    """
+    def root_visits(self):
+        return dict((action, child.visits) for action, child in self.root.action_children.items())
+
+    """
+    moves the root to the child reached by action, keeping that subtree and its stats
+    the rest of the tree is detached so it can be garbage collected
+    returns nothing
+    """
+    def advance(self, action):
+        child = self.root.action_children.get(action)
+        if child is None:
+            child = self.make_node(self.root.state.apply_action(action))
+        child.parent = None
+        self.root.action_children = {}
+        self.root = child
 
     """
     explores using ucb and chooses node to simulate
@@ -65,17 +164,34 @@ class PureMCTS:
         rand_untried_action = node.rand_untried_action(rm=True)
         # make child node with next state + add edges
         next_state = node.state.apply_action(rand_untried_action)
-        child_node = Node(next_state)
+        child_node = self.make_node(next_state)
         child_node.parent = node
         node.action_children[rand_untried_action] = child_node
         return child_node
 
     """
-    ucb
+    returns Node - tree node for state, sharing its stats through the transposition table if enabled
+    """
+    def make_node(self, state):
+        if self.transposition_table is None:
+            return Node(state)
+        return TTNode(state, self.transposition_table.entry(state.zobrist))
+
+    """
+    ucb, same scores as Node.ucb_val with the parent's log term computed once per node instead of
+    once per child (225 children on a 15x15 board)
     returns (action, node) - ucb optimal (action, child node) to explore
     """
     def ucb_action_child(self, node):
-        best_action_child = max(node.action_children.items(), key= lambda (action, child): child.ucb_val())
+        log_term = 2*log(node.visits)
+        best_action_child = None
+        best_val = float('-inf')
+        for action, child in node.action_children.iteritems():
+            visits = child.visits
+            val = float(child.losses)/visits + 2*sqrt(log_term/visits)
+            if val > best_val:
+                best_val = val
+                best_action_child = (action, child)
         return best_action_child
 
     """
@@ -91,6 +207,10 @@ class PureMCTS:
     returns player - winning player
     """
     def default_policy(self, node):
+        if self.rollout_engine is not None:
+            if node.terminal:
+                return node.state.winning_player
+            return self.rollout_engine.play(node.state)
         while not node.terminal:
             rand_action = node.rand_action()
             next_state = node.state.apply_action(rand_action)
@@ -126,7 +246,7 @@ keeps track of state, actions, and stats info of the state
 - rand_action() -> action
 - rand_untried_action() -> action
 """
-class Node:
+class Node(object):
     def __init__(self, state):
         self.state = state
 
@@ -141,7 +261,9 @@ class Node:
         self.all_actions = set(possible_actions)
         self.untried_actions = set(possible_actions)
 
-        # stats
+        self.init_stats()
+
+    def init_stats(self):
         self.visits = 0
         self.wins = 0
         self.losses = 0
@@ -177,3 +299,41 @@ class Node:
 
     def q_val(self):
         return float(self.losses)/self.visits
+
+
+"""
+TTNode --
+Node whose visits, wins and losses live in a TTEntry shared by every node of the same position
+- entry: TTEntry
+"""
+class TTNode(Node):
+    def __init__(self, state, entry):
+        self.entry = entry
+        Node.__init__(self, state)
+
+    def init_stats(self):
+        pass # stats live in the (possibly already visited) entry
+
+    @property
+    def visits(self):
+        return self.entry.visits
+
+    @visits.setter
+    def visits(self, visits):
+        self.entry.visits = visits
+
+    @property
+    def wins(self):
+        return self.entry.wins
+
+    @wins.setter
+    def wins(self, wins):
+        self.entry.wins = wins
+
+    @property
+    def losses(self):
+        return self.entry.losses
+
+    @losses.setter
+    def losses(self, losses):
+        self.entry.losses = losses
@@ -0,0 +1,90 @@
+# Allocation free random playouts for PureMCTS
+
+import random
+
+import numpy as np
+
+"""
+RolloutEngine --
+plays random games to the end on a preallocated board instead of building a Node and a state per ply
+- grid_len, win_amt: int - board geometry
+- play(state) -> player - winning player of a uniformly random playout from state
+Moves are drawn by an in-place Fisher-Yates shuffle of the empty cells done one step per ply, and
+only the four lines through the last move are checked for a win.
+"""
+class RolloutEngine:
+    def __init__(self, grid_len, win_amt, seed=None):
+        self.grid_len = grid_len
+        self.win_amt = win_amt
+        self.cells = ['.'] * (grid_len * grid_len)
+        self.moves = [0] * (grid_len * grid_len)
+        self.lines = self.make_lines()
+        # seeded from numpy so searches stay reproducible under np.random.seed
+        self.rng = random.Random(np.random.randint(2**31) if seed is None else seed)
+
+    """
+    returns list - for every cell index, ((forward indices), (backward indices)) for each of the
+    four line directions, at most win_amt-1 cells each way
+    """
+    def make_lines(self):
+        n = self.grid_len
+        lines = []
+        for r in range(n):
+            for c in range(n):
+                cell_lines = []
+                for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    forward = []
+                    backward = []
+                    for i in range(1, self.win_amt):
+                        if 0 <= r + dr*i < n and 0 <= c + dc*i < n:
+                            forward.append((r + dr*i)*n + c + dc*i)
+                        if 0 <= r - dr*i < n and 0 <= c - dc*i < n:
+                            backward.append((r - dr*i)*n + c - dc*i)
+                    cell_lines.append((tuple(forward), tuple(backward)))
+                lines.append(tuple(cell_lines))
+        return lines
+
+    """
+    state: GomokuState (or anything with grid and curr_player) - non terminal start position
+    returns player - winning player
+    """
+    def play(self, state):
+        cells = self.cells
+        cells[:] = state.grid
+        moves = self.moves
+        num_moves = 0
+        for ind, piece in enumerate(cells):
+            if piece == '.':
+                moves[num_moves] = ind
+                num_moves += 1
+
+        lines = self.lines
+        win_amt = self.win_amt
+        rand = self.rng.random
+        player = state.curr_player
+        for i in range(num_moves):
+            # swap a random not yet played empty cell into slot i and play it
+            j = i + int(rand() * (num_moves - i))
+            ind = moves[j]
+            moves[j] = moves[i]
+            moves[i] = ind
+            cells[ind] = player
+
+            if i == num_moves - 1:
+                #In the unlikely event that no one wins before board is filled
+                #Make white win since black moved first
+                return 'w'
+            for forward, backward in lines[ind]:
+                count = 1
+                for k in forward:
+                    if cells[k] != player:
+                        break
+                    count += 1
+                for k in backward:
+                    if cells[k] != player:
+                        break
+                    count += 1
+                if count >= win_amt:
+                    return player
+            player = 'w' if player == 'b' else 'b'
+        return 'w'
@@ -0,0 +1,72 @@
+# Node/wall-clock budget shared by the searchers' main loops
+
+import time
+
+from constants import BUDGET_CHECK_INTERVAL, THREAT_NODES, THREAT_NODES_PER_SIM, THREAT_TIME_SHARE
+
+"""
+SearchBudget --
+decides when a search loop should stop
+- simulations: int - node budget (None for no limit)
+- deadline: float - time.time() to stop at (None for no limit)
+- can_stop: function(float) -> bool - early termination test given an estimate of the
+  simulations still left in the budget, e.g. whether the leading root child can still be overtaken
+- check_interval: int - simulations between clock reads / early termination tests
+- done(counter) -> bool
+- left(counter) -> int - simulations allowed before the node budget runs out
+"""
+class SearchBudget:
+    def __init__(self, simulations=None, deadline=None, can_stop=None, check_interval=BUDGET_CHECK_INTERVAL):
+        if simulations is None and deadline is None:
+            raise ValueError("A search needs a node budget or a deadline")
+        self.simulations = simulations
+        self.deadline = deadline
+        self.can_stop = can_stop
+        self.check_interval = check_interval
+        self.start = time.time()
+        self.next_check = check_interval
+
+    """
+    counter: int - simulations done so far
+    returns bool - whether the search should stop
+    """
+    def done(self, counter):
+        if self.simulations is not None and counter >= self.simulations:
+            return True
+        # everything below only runs every check_interval simulations
+        if counter < self.next_check:
+            return False
+        self.next_check = counter + self.check_interval
+
+        remaining = float('inf') if self.simulations is None else self.simulations - counter
+        if self.deadline is not None:
+            now = time.time()
+            if now >= self.deadline:
+                return True
+            rate = counter / max(now - self.start, 1e-9)
+            remaining = min(remaining, rate * (self.deadline - now))
+        return self.can_stop is not None and self.can_stop(remaining)
+
+    def left(self, counter):
+        if self.simulations is None:
+            return float('inf')
+        return self.simulations - counter
+
+
+"""
+returns float - deadline time_budget seconds from now (None if time_budget is None)
+"""
+def deadline_after(time_budget):
+    return None if time_budget is None else time.time() + time_budget
+
+
+"""
+budget of the threat search run before a search with these budgets, so it stays a fraction of
+the move: THREAT_NODES_PER_SIM nodes per simulation and THREAT_TIME_SHARE of time_budget
+returns (int, float) - (node budget, deadline or None)
+"""
+def solver_budget(simulations, time_budget):
+    max_nodes = THREAT_NODES
+    if simulations is not None:
+        max_nodes = max(1, min(max_nodes, THREAT_NODES_PER_SIM * simulations))
+    return max_nodes, deadline_after(None if time_budget is None else THREAT_TIME_SHARE * max(time_budget, 0))
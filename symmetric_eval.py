@@ -0,0 +1,66 @@
+# Symmetry augmented evaluation in front of a policy value network
+
+import numpy as np
+
+from symmetry import NUM_SYMMETRIES, transform_planes, inverse_transform_planes
+from board_encoder import encode_batch
+
+SYMMETRY_MODES = ('average', 'random')
+
+"""
+SymmetricEvaluator --
+evaluates boards under the 8 dihedral symmetries to smooth out the noise of the pretrained nets
+- net: PolicyValueNetNumpy - needs policy_value(state_batch)
+- mode: str
+    'average': all 8 transformed copies of every board go through one batched forward pass,
+    the policies are turned back and averaged with the values
+    'random': every board is evaluated under one random symmetry, drawn from np.random unless a
+    seed is given (not cached by model_registry, the result depends on the draw)
+Exposes the same policy_value_fn/policy_value_batch_fn interface as PolicyValueNetNumpy.
+"""
+class SymmetricEvaluator(object):
+    def __init__(self, net, mode='average', seed=None):
+        if mode not in SYMMETRY_MODES:
+            raise ValueError("Unknown symmetry mode: {}".format(mode))
+        self.net = net
+        self.mode = mode
+        # the global generator by default: every game and search reseeds it, while a generator of
+        # its own would carry its state from one game to the next in the process' shared evaluator
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+
+    """
+    returns (list, float) - ([(action, probability)], value) like PolicyValueNetNumpy.policy_value_fn
+    """
+    def policy_value_fn(self, board):
+        return self.policy_value_batch_fn([board])[0]
+
+    """
+    returns list - (act_probs, value) per board, from a single forward pass
+    """
+    def policy_value_batch_fn(self, boards):
+        planes = encode_batch(boards)
+        if self.mode == 'average':
+            syms = np.tile(np.arange(NUM_SYMMETRIES), len(boards))
+            planes = np.repeat(planes, NUM_SYMMETRIES, axis=0)
+        else:
+            syms = self.rng.randint(NUM_SYMMETRIES, size=len(boards))
+        state_batch = np.array([transform_planes(p, sym) for p, sym in zip(planes, syms)])
+        act_probs, values = self.net.policy_value(state_batch)
+
+        # back to the orientation of the input planes, see prob_grid
+        n = planes.shape[-1]
+        grids = np.array([inverse_transform_planes(prob_grid(probs, n), sym)
+                          for probs, sym in zip(act_probs, syms)])
+        if self.mode == 'average':
+            grids = grids.reshape(len(boards), NUM_SYMMETRIES, n, n).mean(axis=1)
+            values = values.reshape(len(boards), NUM_SYMMETRIES).mean(axis=1)
+        return [(board.act_probs_from_grid(grid), values[i])
+                for i, (board, grid) in enumerate(zip(boards, grids))]
+
+"""
+the net's output index k is the move k of its own board, which current_state()
+shows upside down, i.e. at plane cell (n-1-k//n, k%n)
+returns ndarray - probs laid out like the input planes
+"""
+def prob_grid(probs, n):
+    return probs.reshape(n, n)[::-1]
@@ -0,0 +1,25 @@
+# The 8 dihedral symmetries of a square board
+
+import numpy as np
+
+NUM_SYMMETRIES = 8
+
+"""
+applies symmetry sym to the last two (row, col) axes of planes
+sym: int - 0-3 rotate 90 degrees sym times, 4-7 same rotation followed by a left-right flip
+returns ndarray - transformed view of planes
+"""
+def transform_planes(planes, sym):
+    out = np.rot90(planes, sym % 4, axes=(-2, -1))
+    if sym >= 4:
+        out = out[..., ::-1]
+    return out
+
+"""
+undoes transform_planes(planes, sym)
+returns ndarray - planes in the original orientation
+"""
+def inverse_transform_planes(planes, sym):
+    if sym >= 4:
+        planes = planes[..., ::-1]
+    return np.rot90(planes, -(sym % 4), axes=(-2, -1))
@@ -0,0 +1,307 @@
+# Threat space search: forced wins by continuous fours (VCF) and by threes (VCT)
+#
+# A "four" is a move after which the attacker wins next move unless blocked (a window of win_amt
+# cells holding win_amt-1 of its stones and no opponent stone), a "three" a move that leaves a
+# window with win_amt-2 stones after which the attacker has a VCF if the defender ignores it.
+
+import time
+
+from constants import THREAT_NODES, THREAT_VCF_DEPTH, THREAT_VCT_DEPTH, THREAT_LEAF_NODES, THREAT_CLOCK_INTERVAL
+
+_windows = {}
+
+"""
+returns (list, list) - (every window of win_amt cells in a line as a tuple of cell indices,
+for every cell the indices of the windows containing it), built once per geometry
+"""
+def get_windows(grid_len, win_amt):
+    key = (grid_len, win_amt)
+    if key not in _windows:
+        windows = []
+        n = grid_len
+        for r in range(n):
+            for c in range(n):
+                for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    end_r, end_c = r + dr*(win_amt-1), c + dc*(win_amt-1)
+                    if 0 <= end_r < n and 0 <= end_c < n:
+                        windows.append(tuple((r + dr*i)*n + c + dc*i for i in range(win_amt)))
+        cell_windows = [[] for _ in range(n*n)]
+        for w, window in enumerate(windows):
+            for cell in window:
+                cell_windows[cell].append(w)
+        _windows[key] = (windows, [tuple(ws) for ws in cell_windows])
+    return _windows[key]
+
+
+class OutOfBudget(Exception):
+    pass
+
+
+"""
+ThreatSolver --
+depth and node limited threat space search on a scratch board with per window stone counts
+- grid_len, win_amt: int - board geometry
+- max_nodes: int - nodes per solve before giving up (the result is then None, i.e. unknown)
+- vcf_depth: int - max fours in a row, vct_depth: int - max threes in a line
+- forced_move(state, max_nodes, deadline) -> action - move to play without searching (win now, the
+  only block, VCF/VCT win); the VCF/VCT search gives up after max_nodes nodes or at deadline
+- leaf_value(state, max_nodes) -> float - 1/-1 if the player to move is known to win/lose, else None
+- vcf(state), vct(state) -> list - winning line of attacker moves for state.curr_player, None if not found
+Moves found are sound under the limits: every defence (all empty cells against a three, the
+block or a winning counter move against a four) is refuted.
+"""
+class ThreatSolver:
+    def __init__(self, grid_len, win_amt, max_nodes=THREAT_NODES, vcf_depth=THREAT_VCF_DEPTH,
+                 vct_depth=THREAT_VCT_DEPTH):
+        self.grid_len = grid_len
+        self.win_amt = win_amt
+        self.max_nodes = max_nodes
+        self.vcf_depth = vcf_depth
+        self.vct_depth = vct_depth
+        self.windows, self.cell_windows = get_windows(grid_len, win_amt)
+        self.nodes = 0
+        self.budget = max_nodes
+        self.deadline = None
+
+    """
+    copies state's grid onto the scratch board
+    """
+    def load(self, state):
+        self.cells = list(state.grid)
+        self.counts = {'b': [0] * len(self.windows), 'w': [0] * len(self.windows)}
+        for w, window in enumerate(self.windows):
+            for cell in window:
+                if self.cells[cell] != '.':
+                    self.counts[self.cells[cell]][w] += 1
+        self.nodes = 0
+
+    def play(self, cell, player):
+        self.cells[cell] = player
+        counts = self.counts[player]
+        for w in self.cell_windows[cell]:
+            counts[w] += 1
+
+    def undo(self, cell, player):
+        self.cells[cell] = '.'
+        counts = self.counts[player]
+        for w in self.cell_windows[cell]:
+            counts[w] -= 1
+
+    def visit(self):
+        self.nodes += 1
+        if self.nodes > self.budget:
+            raise OutOfBudget()
+        if self.deadline is not None and self.nodes % THREAT_CLOCK_INTERVAL == 0 and time.time() >= self.deadline:
+            raise OutOfBudget()
+
+    """
+    returns list - empty cells where player would complete win_amt in a row
+    """
+    def winning_cells(self, player):
+        own, other = self.counts[player], self.counts[opponent(player)]
+        target = self.win_amt - 1
+        cells = []
+        for w, window in enumerate(self.windows):
+            if own[w] == target and other[w] == 0:
+                for cell in window:
+                    if self.cells[cell] == '.' and cell not in cells:
+                        cells.append(cell)
+        return cells
+
+    """
+    returns list - empty cells in windows holding stones of player (and none of the opponent),
+    windows with more stones first so fours come before threes
+    stones: int - only windows with at least this many of player's stones
+    """
+    def threat_moves(self, player, stones):
+        own, other = self.counts[player], self.counts[opponent(player)]
+        by_count = {}
+        for w, window in enumerate(self.windows):
+            if own[w] >= stones and other[w] == 0:
+                by_count.setdefault(own[w], []).append(window)
+        moves = []
+        seen = set()
+        for count in sorted(by_count, reverse=True):
+            for window in by_count[count]:
+                for cell in window:
+                    if self.cells[cell] == '.' and cell not in seen:
+                        seen.add(cell)
+                        moves.append(cell)
+        return moves
+
+    """
+    deadline: float - time.time() to give up at (None for the node budget only)
+    returns list - search's result, None if it ran out of nodes or time
+    """
+    def run(self, search, budget, deadline=None):
+        self.budget = budget
+        self.deadline = deadline
+        self.nodes = 0
+        try:
+            return search()
+        except OutOfBudget:
+            return None
+        finally:
+            self.deadline = None
+
+    def vcf(self, state, max_nodes=None, deadline=None):
+        self.load(state)
+        line = self.run(lambda: self.search_vcf(state.curr_player, self.vcf_depth), max_nodes or self.max_nodes,
+                        deadline)
+        return self.to_moves(line)
+
+    def vct(self, state, max_nodes=None, deadline=None):
+        self.load(state)
+        line = self.run(lambda: self.search_vct(state.curr_player, self.vct_depth), max_nodes or self.max_nodes,
+                        deadline)
+        return self.to_moves(line)
+
+    """
+    attacker to move, only fours (or a block that is itself a four)
+    returns list - attacker moves of a forced win, None if there is none within depth
+    """
+    def search_vcf(self, attacker, depth):
+        self.visit()
+        defender = opponent(attacker)
+        wins = self.winning_cells(attacker)
+        if wins:
+            return [wins[0]]
+        blocks = self.winning_cells(defender)
+        if len(blocks) > 1 or depth == 0:
+            return None
+        candidates = blocks if blocks else self.threat_moves(attacker, self.win_amt - 2)
+        for move in candidates:
+            self.play(move, attacker)
+            line = self.after_four(attacker, defender, move, depth)
+            self.undo(move, attacker)
+            if line is not None:
+                return line
+        return None
+
+    """
+    attacker just played move, the defender must block if it made a four
+    returns list - forced win starting with move, None if move doesn't force one
+    """
+    def after_four(self, attacker, defender, move, depth):
+        if self.winning_cells(defender):
+            return None # defender wins first
+        wins = self.winning_cells(attacker)
+        if len(wins) > 1:
+            return [move]
+        if len(wins) == 0:
+            return None
+        self.play(wins[0], defender)
+        line = self.search_vcf(attacker, depth - 1)
+        self.undo(wins[0], defender)
+        return None if line is None else [move] + line
+
+    """
+    attacker to move, fours and threes
+    returns list - attacker moves of a forced win (the first move is the one to play), None if not found
+    """
+    def search_vct(self, attacker, depth):
+        line = self.search_vcf(attacker, self.vcf_depth)
+        if line is not None or depth == 0:
+            return line
+        self.visit()
+        defender = opponent(attacker)
+        blocks = self.winning_cells(defender)
+        if len(blocks) > 1:
+            return None
+        candidates = blocks if blocks else self.threat_moves(attacker, self.win_amt - 3)
+        for move in candidates:
+            self.play(move, attacker)
+            if self.proves_three(attacker, defender, move, depth):
+                self.undo(move, attacker)
+                return [move]
+            self.undo(move, attacker)
+        return None
+
+    """
+    attacker just played move: it's a winning threat if the attacker would have a VCF after a pass
+    and still wins after every defender reply
+    returns bool
+    """
+    def proves_three(self, attacker, defender, move, depth):
+        if self.winning_cells(defender):
+            return False
+        wins = self.winning_cells(attacker)
+        if len(wins) > 1:
+            return True
+        if len(wins) == 1:
+            replies = wins # a four, the block is forced
+        else:
+            if self.search_vcf(attacker, self.vcf_depth) is None:
+                return False # no threat, the defender can play anywhere
+            replies = self.relevant_first(move)
+        for reply in replies:
+            self.play(reply, defender)
+            line = self.search_vct(attacker, depth - 1 if len(wins) == 0 else depth)
+            self.undo(reply, defender)
+            if line is None:
+                return False
+        return True
+
+    """
+    returns list - every empty cell, those sharing a window with move first (likelier refutations)
+    """
+    def relevant_first(self, move):
+        near = []
+        seen = set()
+        for w in self.cell_windows[move]:
+            for cell in self.windows[w]:
+                if self.cells[cell] == '.' and cell not in seen:
+                    seen.add(cell)
+                    near.append(cell)
+        return near + [cell for cell, piece in enumerate(self.cells) if piece == '.' and cell not in seen]
+
+    def to_moves(self, line):
+        if line is None:
+            return None
+        return [(cell // self.grid_len, cell % self.grid_len) for cell in line]
+
+    """
+    returns action - winning move, the only move stopping an immediate loss, or the first move of a
+    VCF/VCT win for state.curr_player; None if the position needs a search
+    max_nodes: int - nodes for the VCF and VCT searches together (self.max_nodes if not given)
+    deadline: float - time.time() to give up the VCF/VCT search at (None for no limit)
+    """
+    def forced_move(self, state, max_nodes=None, deadline=None):
+        if state.terminal:
+            return None
+        self.load(state)
+        player = state.curr_player
+        wins = self.winning_cells(player)
+        if wins:
+            return self.to_moves(wins)[0]
+        blocks = self.winning_cells(opponent(player))
+        if len(blocks) == 1:
+            return self.to_moves(blocks)[0]
+        if blocks:
+            return None # lost anyway, let the search pick
+        max_nodes = max_nodes or self.max_nodes
+        line = self.vcf(state, max_nodes, deadline)
+        if line is None and self.nodes < max_nodes and (deadline is None or time.time() < deadline):
+            line = self.vct(state, max_nodes - self.nodes, deadline)
+        return line[0] if line else None
+
+    """
+    cheap check for leaf evaluation: immediate wins, unstoppable double threats and short VCFs
+    returns float - 1 if the player to move wins, -1 if they lose, None if unknown
+    """
+    def leaf_value(self, state, max_nodes=THREAT_LEAF_NODES):
+        if state.terminal:
+            return None
+        self.load(state)
+        player = state.curr_player
+        if self.winning_cells(player):
+            return 1
+        if len(self.winning_cells(opponent(player))) > 1:
+            return -1
+        if self.run(lambda: self.search_vcf(player, self.vcf_depth), max_nodes) is not None:
+            return 1
+        return None
+
+
+def opponent(player):
+    return 'w' if player == 'b' else 'b'
@@ -0,0 +1,113 @@
+# Transposition table shared by the mcts nodes of positions reached through different move orders
+
+from collections import OrderedDict
+
+REPLACEMENT_POLICIES = ('lru', 'min_visits')
+
+"""
+TTEntry --
+stats shared by every node whose state has the same key (the zobrist hash for PureMCTS, the hash
+and last move for AlphaZeroMCTS, see alphazero_mcts.tt_key)
+- visits, value: AlphaZeroMCTS stats
+- visits, wins, losses: PureMCTS stats
+- evaluation: (float, action -> float) - cached (value, action probs) from the value network
+- edges: alphazero_mcts.Edges - edges (with their stats) of the first expanded node of the position
+"""
+class TTEntry(object):
+    __slots__ = ('visits', 'value', 'wins', 'losses', 'evaluation', 'edges')
+
+    def __init__(self):
+        self.visits = 0
+        self.value = 0
+        self.wins = 0
+        self.losses = 0
+        self.evaluation = None
+        self.edges = None
+
+
+"""
+TranspositionTable --
+size bounded map of position key -> TTEntry
+- max_size: int - max number of entries kept
+- replacement: str - which entry to drop when full
+    'lru': least recently used entry
+    'min_visits': least visited entry among the evict_sample least recently used ones
+- hits, misses, evictions: int - counters
+Evicted entries keep working for the nodes that already hold them, they just stop being shared.
+"""
+class TranspositionTable(object):
+    def __init__(self, max_size, replacement='lru', evict_sample=8):
+        if replacement not in REPLACEMENT_POLICIES:
+            raise ValueError("Unknown replacement policy: {}".format(replacement))
+        self.max_size = max_size
+        self.replacement = replacement
+        self.evict_sample = evict_sample
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    """
+    returns TTEntry - the entry for key (or None if missing), marked as most recently used
+    """
+    def lookup(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.entries[key] = entry
+        return entry
+
+    """
+    returns TTEntry - the entry for key, created (evicting another one if full) if missing
+    """
+    def entry(self, key):
+        entry = self.lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        if len(self.entries) >= self.max_size:
+            self.evict()
+        entry = TTEntry()
+        self.entries[key] = entry
+        return entry
+
+    """
+    removes one entry according to the replacement policy
+    returns nothing
+    """
+    def evict(self):
+        if not self.entries:
+            return
+        if self.replacement == 'lru':
+            self.entries.popitem(last=False)
+        else:
+            candidates = []
+            for key in self.entries:
+                candidates.append(key)
+                if len(candidates) >= self.evict_sample:
+                    break
+            victim = min(candidates, key=lambda key: self.entries[key].visits)
+            del self.entries[victim]
+        self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    """
+    returns dict - size and hit/miss/eviction counters
+    """
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
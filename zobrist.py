@@ -0,0 +1,32 @@
+# Zobrist hashing of gomoku positions
+
+import random
+
+ZOBRIST_SEED = 20180611
+
+_keys = {}
+
+"""
+random 64 bit keys for every (player, cell), fixed per board size so hashes are stable across runs
+returns dict - maps: player -> list of keys indexed like a flat grid
+"""
+def get_zobrist_keys(grid_len):
+    if grid_len not in _keys:
+        rng = random.Random(ZOBRIST_SEED + grid_len)
+        _keys[grid_len] = {
+            'b': [rng.getrandbits(64) for _ in range(grid_len * grid_len)],
+            'w': [rng.getrandbits(64) for _ in range(grid_len * grid_len)],
+        }
+    return _keys[grid_len]
+
+"""
+full hash of a flat grid, states update it incrementally with zobrist ^ keys[player][ind]
+returns int - xor of the keys of every piece on the grid
+"""
+def zobrist_hash(grid, grid_len):
+    keys = get_zobrist_keys(grid_len)
+    result = 0
+    for ind, piece in enumerate(grid):
+        if piece != '.':
+            result ^= keys[piece][ind]
+    return result